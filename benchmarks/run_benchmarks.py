@@ -0,0 +1,164 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import h5py
+import core.animation as anim
+from core.utils import match_length, inference_err, calculate_average_error
+from core.pointcloud import PointCloudFrames, PackedPointCloud, pack_point_cloud
+from benchmarks.synthetic import write_bvh, write_h5
+
+
+def load(path, **kwargs):
+    motion = anim.Animation()
+    motion.load_bvh(path, cache=False, **kwargs)
+    return motion
+
+def read_h5_dict(path):
+    # the loop viz_mocap_pcd.py used before frames were read on demand
+    pcd_np_dict = {}
+    with h5py.File(path, 'r') as pcd_data:
+        for frame_idx in range(len(pcd_data.keys())):
+            group = pcd_data[f"frame-{frame_idx:06}"]
+            if 'pointcloud' in group:
+                pcd_np_dict[frame_idx] = np.asarray(group['pointcloud'][()], dtype=np.float32)
+            else:
+                pcd_np_dict[frame_idx] = np.array([])
+    return pcd_np_dict
+
+def read_all(frames):
+    with frames:
+        for frame in frames:
+            pass
+
+def make_benchmarks(workdir, num_frames, lidar_frames):
+    """
+    Generate the synthetic inputs and return [(name, fn)] of the timed operations.
+    """
+    bvh = os.path.join(workdir, 'take.bvh')
+    bvh_out = os.path.join(workdir, 'take_model.bvh')
+    bvh_20 = os.path.join(workdir, 'take_model_20.bvh')
+    bvh_blender = os.path.join(workdir, 'take_blender.bvh')
+    h5 = os.path.join(workdir, 'take.h5')
+    h5_packed = os.path.join(workdir, 'take_packed.h5')
+    write_bvh(bvh, num_frames, seed=0)
+    write_bvh(bvh_out, num_frames, seed=1)
+    write_bvh(bvh_20, num_frames // 3, fps=20, seed=2)
+    write_bvh(bvh_blender, num_frames, blender=True, seed=3)
+    write_h5(h5, lidar_frames, missing_every=50)
+    pack_point_cloud(h5, h5_packed)
+
+    gt, out = load(bvh), load(bvh_out)
+    match_length([gt, out])
+    gt.compute_world_transform(fix_root=True)
+    out.compute_world_transform(fix_root=True)
+    low = load(bvh_20)
+
+    num_files = 40
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1000, 5000, size=num_files)
+    per_joint = [rng.random((num_files, gt.joints.shape[0])) for _ in range(4)]
+    joint_names = np.insert(gt.joints, 0, 'length')
+    file_names = [f'file_{i}' for i in range(num_files)]
+    result_path = os.path.join(workdir, 'results_')
+
+    def dup_upsample():
+        motion = anim.copy(low)
+        motion.dup_upsample(3)
+
+    return [
+        ('load_bvh', lambda: load(bvh)),
+        ('load_bvh_blender', lambda: load(bvh_blender, blender=True)),
+        ('load_bvh_upsample3', lambda: load(bvh_20, upsample=3)),
+        ('load_bvh_downsample3', lambda: load(bvh, upsample=-3)),
+        ('save_bvh', lambda: gt.save_bvh(os.path.join(workdir, 'saved.bvh'))),
+        ('compute_world_transform', lambda: gt.compute_world_transform(fix_root=True)),
+        # uncached world_positions: all joints, and the frames of a 20 Hz LiDAR take
+        ('world_positions', lambda: anim.forward_positions(gt.local_t, gt.parents, np.arange(len(gt.parents)))),
+        ('world_positions_20hz', lambda: anim.forward_positions(gt.local_t[::3], gt.parents, np.arange(len(gt.parents)), fix_root=False)),
+        ('dup_upsample3', dup_upsample),
+        ('inference_err', lambda: inference_err(out, gt)),
+        ('calculate_average_error', lambda: calculate_average_error(lengths, *per_joint, joint_names, file_names, result_path, 'bench')),
+        ('h5_read_dict', lambda: read_h5_dict(h5)),
+        ('h5_read_frames', lambda: read_all(PointCloudFrames(h5, prefetch=0))),
+        ('h5_read_packed', lambda: read_all(PackedPointCloud(h5_packed))),
+    ]
+
+def run(num_frames, lidar_frames, repeat, only=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarks = make_benchmarks(workdir, num_frames, lidar_frames)
+        for name, fn in benchmarks:
+            if only and not any(pattern in name for pattern in only):
+                continue
+            times = []
+            for _ in range(repeat):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    fn()
+                    times.append(time.perf_counter() - start)
+            results[name] = {'min': min(times), 'mean': float(np.mean(times)), 'repeat': repeat}
+            print(f'{name:28s} min {min(times) * 1000:10.2f} ms   mean {np.mean(times) * 1000:10.2f} ms')
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Print the speed ratio against a previous run, return the names that got slower than threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['min'] / baseline[name]['min']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  <-- regression'
+        print(f'{name:28s} {ratio:6.2f}x of baseline{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the motion and point cloud pipeline on synthetic data.')
+    parser.add_argument('--frames', type=int, default=3600, help='Number of 60 Hz BVH frames')
+    parser.add_argument('--lidar-frames', type=int, default=None, help='Number of 20 Hz LiDAR frames (default frames / 3)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', type=str, nargs='*', help='Run only benchmarks whose name contains one of these')
+    parser.add_argument('--out', type=str, default='benchmark_results.json', help='Where to save the results (JSON)')
+    parser.add_argument('--compare', type=str, default=None, help='Results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    lidar_frames = args.lidar_frames or args.frames // 3
+    results = run(args.frames, lidar_frames, args.repeat, args.only)
+    report = {
+        'meta': {
+            'frames': args.frames,
+            'lidar_frames': lidar_frames,
+            'repeat': args.repeat,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved results to {args.out}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import numpy as np
+import h5py
+
+# 21-joint skeleton with the hierarchy of the ELMO/MOVIN captures: (name, parent index)
+JOINTS = [
+    ('Hips', -1), ('Spine', 0), ('Spine1', 1), ('Neck', 2), ('Head', 3),
+    ('LeftShoulder', 2), ('LeftArm', 5), ('LeftForeArm', 6), ('LeftHand', 7),
+    ('RightShoulder', 2), ('RightArm', 9), ('RightForeArm', 10), ('RightHand', 11),
+    ('LeftUpLeg', 0), ('LeftLeg', 13), ('LeftFoot', 14), ('LeftToeBase', 15),
+    ('RightUpLeg', 0), ('RightLeg', 17), ('RightFoot', 18), ('RightToeBase', 19),
+]
+
+
+def write_bvh(path, num_frames, fps=60, blender=False, seed=0):
+    """
+    Write a smooth random motion on the 21-joint skeleton. With blender=True every joint has
+    6 channels (position + rotation) like the Blender exports, otherwise only the root does.
+    """
+    rng = np.random.default_rng(seed)
+    num_joints = len(JOINTS)
+    children = [[c for c, (_, p) in enumerate(JOINTS) if p == j] for j in range(num_joints)]
+    offsets = rng.normal(scale=0.1, size=(num_joints, 3))
+
+    lines = ['HIERARCHY']
+    def write_joint(j, depth):
+        indent = '\t' * depth
+        lines.append(f"{indent}{'ROOT' if j == 0 else 'JOINT'} {JOINTS[j][0]}")
+        lines.append(indent + '{')
+        lines.append(f'{indent}\tOFFSET %.6f %.6f %.6f' % tuple(offsets[j]))
+        if j == 0 or blender:
+            lines.append(f'{indent}\tCHANNELS 6 Xposition Yposition Zposition Zrotation Yrotation Xrotation')
+        else:
+            lines.append(f'{indent}\tCHANNELS 3 Zrotation Yrotation Xrotation')
+        for c in children[j]:
+            write_joint(c, depth + 1)
+        if not children[j]:
+            lines.extend([f'{indent}\tEnd Site', indent + '\t{', f'{indent}\t\tOFFSET 0.000000 0.100000 0.000000', indent + '\t}'])
+        lines.append(indent + '}')
+    write_joint(0, 0)
+    lines += ['MOTION', f'Frames: {num_frames}', f'Frame Time: {1 / fps:.7f}']
+
+    t = np.arange(num_frames)[:, None]
+    freq = rng.uniform(0.5, 2.0, size=3 * num_joints) * 6.0 / fps
+    phase = rng.uniform(0, 2 * np.pi, size=3 * num_joints)
+    rot = (40 * np.sin(t * freq + phase)).reshape(num_frames, num_joints, 3)
+    root = np.concatenate((np.sin(t * 0.6 / fps), 1 + 0.1 * np.cos(t * 1.8 / fps), t * 0.3 / fps), axis=1)
+    if blender:
+        pos = np.broadcast_to(offsets, (num_frames, num_joints, 3)).copy()
+        pos[:, 0] = root
+        motion = np.stack((pos, rot), axis=2).reshape(num_frames, -1)
+    else:
+        motion = np.concatenate((root, rot.reshape(num_frames, -1)), axis=1)
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+        np.savetxt(f, motion, fmt='%.6f')
+
+
+def write_h5(path, num_frames, min_points=200, max_points=1000, missing_every=0, seed=0):
+    """
+    Write a LiDAR-like .h5 with one frame-XXXXXX/pointcloud group per frame (x, y, z, intensity).
+    With missing_every > 0 every missing_every-th group has no pointcloud dataset.
+    """
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, 'w') as f:
+        for i in range(num_frames):
+            group = f.create_group(f"frame-{i:06}")
+            if missing_every > 0 and i % missing_every == missing_every - 1:
+                continue
+            n = rng.integers(min_points, max_points)
+            group.create_dataset('pointcloud', data=rng.normal(size=(n, 4)).astype(np.float32))
@@ -0,0 +1,91 @@
+import numpy as np
+import core.animation as anim
+
+MOTION_FPS = 60
+LIDAR_FPS = 20
+
+
+def lidar_length_of(motion_length, motion_fps=MOTION_FPS, lidar_fps=LIDAR_FPS, motion_offset=0.0, lidar_offset=0.0):
+    """
+    Number of LiDAR frames from the first one up to the last motion frame.
+    """
+    end = motion_offset + (motion_length - 1) / motion_fps
+    return max(int(np.floor((end - lidar_offset) * lidar_fps + 1e-6)) + 1, 0)
+
+
+class Alignment:
+    """
+    Time alignment of a mocap take and its LiDAR take. Motion frame i is at
+    motion_offset + i / motion_fps seconds, LiDAR frame k at lidar_offset + k / lidar_fps.
+    The (fractional) motion frame of every LiDAR frame and the nearest frame of the other
+    stream in both directions are precomputed, so lookups are O(1) array reads.
+    With the default 60 Hz / 20 Hz and no offsets, LiDAR frame k is motion frame 3k.
+
+        alignment = Alignment.of(motion, len(points))
+        lidar_motion = alignment.resample(motion)   # frame k is the pose at LiDAR frame k
+    """
+    def __init__(self, motion_length, lidar_length, motion_fps=MOTION_FPS, lidar_fps=LIDAR_FPS,
+                 motion_offset=0.0, lidar_offset=0.0):
+        self.motion_length = motion_length
+        self.lidar_length = lidar_length
+        self.motion_fps = motion_fps
+        self.lidar_fps = lidar_fps
+        self.motion_offset = motion_offset
+        self.lidar_offset = lidar_offset
+
+        self.lidar_times = lidar_offset + np.arange(lidar_length) / lidar_fps
+        self.motion_times = motion_offset + np.arange(motion_length) / motion_fps
+        pos = (self.lidar_times - motion_offset) * motion_fps
+        # 1 / 20 * 60 is not exactly 3, snap rounding noise so shared instants copy the frame
+        snapped = np.round(pos)
+        self.motion_pos = np.where(np.abs(pos - snapped) < 1e-6, snapped, pos)
+        # LiDAR frames inside the motion, the others are clamped to its first or last frame
+        self.covered = (self.motion_pos >= 0) & (self.motion_pos <= motion_length - 1)
+        self.motion_index = np.clip(np.round(self.motion_pos), 0, max(motion_length - 1, 0)).astype(np.int64)
+        lidar_pos = (self.motion_times - lidar_offset) * lidar_fps
+        self.lidar_index = np.clip(np.round(lidar_pos), 0, max(lidar_length - 1, 0)).astype(np.int64)
+
+    @classmethod
+    def of(cls, motion, lidar_length=None, lidar_fps=LIDAR_FPS, motion_offset=0.0, lidar_offset=0.0):
+        """
+        Alignment of a loaded Animation. Without lidar_length, the LiDAR take is assumed to
+        span the motion.
+        """
+        if lidar_length is None:
+            lidar_length = lidar_length_of(motion.length, motion.fps, lidar_fps, motion_offset, lidar_offset)
+        return cls(motion.length, lidar_length, motion.fps, lidar_fps, motion_offset, lidar_offset)
+
+    def motion_frame(self, k):
+        """
+        Nearest motion frame of LiDAR frame(s) k.
+        """
+        return self.motion_index[k]
+
+    def lidar_frame(self, i):
+        """
+        Nearest LiDAR frame of motion frame(s) i.
+        """
+        return self.lidar_index[i]
+
+    def motion_pos_at(self, times):
+        """
+        Fractional motion frames of arbitrary timestamps in seconds.
+        """
+        return (np.asarray(times, dtype=np.float64) - self.motion_offset) * self.motion_fps
+
+    def sample(self, motion, times):
+        """
+        Local transforms (K, J, 4, 4) of motion at timestamps (K,), in one batched slerp/lerp.
+        """
+        return anim.sample_transforms(motion.local_t, self.motion_pos_at(times))
+
+    def resample(self, motion, lidar_frames=slice(None)):
+        """
+        Copy of motion at the LiDAR rate: its frame k is the pose at LiDAR frame lidar_frames[k]
+        (all of them by default). Poses between two motion frames are interpolated in one batched call,
+        those on a motion frame are copied.
+        """
+        result = anim.copy(motion)
+        result.sample(self.motion_pos[lidar_frames])
+        result.fps = self.lidar_fps
+        return result
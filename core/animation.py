@@ -1,7 +1,10 @@
 import os
 import re
+import itertools
 import numpy as np
 from scipy.spatial.transform import Rotation as R
+from core.cache import get_default_cache
+from core.profiling import profiler
 
 def copy(self):
     cls = self.__class__
@@ -28,21 +31,132 @@ def lerp(a, b, t):
     interpolated_vector = (1 - t) * a + t * b
     return interpolated_vector
 
-def slerp(q1, q2, t):
+def slerp(q1, q2, t, eps=1e-8):
+    # works on single quaternions as well as on broadcastable (..., 4) stacks
     q1 = np.array(q1, dtype=np.float64)
     q2 = np.array(q2, dtype=np.float64)
-    q1 /= np.linalg.norm(q1)
-    q2 /= np.linalg.norm(q2)
-    dot_product = np.dot(q1, q2)
-    dot_product = np.clip(dot_product, -1.0, 1.0)
+    q1 /= np.linalg.norm(q1, axis=-1, keepdims=True)
+    q2 /= np.linalg.norm(q2, axis=-1, keepdims=True)
+    dot_product = np.sum(q1 * q2, axis=-1, keepdims=True)
+    # q and -q are the same rotation, take the shortest arc
+    q2 = np.where(dot_product < 0, -q2, q2)
+    dot_product = np.clip(np.abs(dot_product), -1.0, 1.0)
     theta = np.arccos(dot_product)
     sin_theta = np.sin(theta)
-    interpolated_quaternion = (
-        np.sin((1 - t) * theta) / sin_theta * q1 +
-        np.sin(t * theta) / sin_theta * q2
-    )
+    # (nearly) identical keys: sin(theta) -> 0, fall back to lerp
+    near = sin_theta < eps
+    sin_theta = np.where(near, 1.0, sin_theta)
+    w1 = np.where(near, 1 - t, np.sin((1 - t) * theta) / sin_theta)
+    w2 = np.where(near, t, np.sin(t * theta) / sin_theta)
+    interpolated_quaternion = w1 * q1 + w2 * q2
     return interpolated_quaternion
 
+def interp_upsample_qt(local_q, local_p, n):
+    """
+    Upsample quaternions (T, J, 4) and translations (T, J, 3) n times by slerp and lerp.
+    Returns (T - 1) * n frames, the last key is not repeated.
+    """
+    length, num_joints = local_q.shape[:2]
+    new_length = max(length - 1, 0) * n
+    t = (np.arange(n) / n).reshape(1, n, 1, 1)
+    p_lerp = lerp(local_p[:-1, None], local_p[1:, None], t)
+    r_slerp = slerp(local_q[:-1, None], local_q[1:, None], t)
+    r_slerp /= np.linalg.norm(r_slerp, axis=-1, keepdims=True)
+    return r_slerp.reshape(new_length, num_joints, 4), p_lerp.reshape(new_length, num_joints, 3)
+
+def interp_upsample(local_t, n):
+    """
+    Upsample local transforms (T, J, 4, 4) n times, lerping translations and
+    slerping rotations of all frames and joints at once.
+    Returns (T - 1) * n frames, the last key is not repeated.
+    """
+    length, num_joints = local_t.shape[:2]
+    if length < 2:
+        return np.zeros((0, num_joints, 4, 4), dtype=local_t.dtype)
+    local_q, local_p = decompose_transforms(local_t)
+    return compose_transforms(*interp_upsample_qt(local_q, local_p, n), dtype=local_t.dtype)
+
+def sample_qt(local_q, local_p, frames):
+    """
+    Quaternions and translations at fractional frame positions (K,), slerp and lerp between
+    the two surrounding frames of all positions at once. Positions are clamped to the take.
+    """
+    length = local_q.shape[0]
+    frames = np.clip(np.asarray(frames, dtype=np.float64), 0, length - 1)
+    i0 = np.minimum(np.floor(frames).astype(np.int64), max(length - 2, 0))
+    i1 = np.minimum(i0 + 1, length - 1)
+    t = (frames - i0).reshape(-1, 1, 1)
+    r_slerp = slerp(local_q[i0], local_q[i1], t)
+    r_slerp /= np.linalg.norm(r_slerp, axis=-1, keepdims=True)
+    return r_slerp, lerp(local_p[i0], local_p[i1], t)
+
+def sample_transforms(local_t, frames):
+    """
+    Local transforms (K, J, 4, 4) at fractional frame positions (K,). Integer positions are copied,
+    the others are interpolated by sample_qt, decomposing only the frames around them.
+    """
+    length = local_t.shape[0]
+    frames = np.clip(np.asarray(frames, dtype=np.float64), 0, length - 1)
+    exact = frames == np.round(frames)
+    out = np.empty((len(frames),) + local_t.shape[1:], dtype=local_t.dtype)
+    out[exact] = local_t[np.round(frames[exact]).astype(np.int64)]
+    if not exact.all():
+        between = frames[~exact]
+        i0 = np.floor(between).astype(np.int64)
+        # i0 and i0 + 1 are neighbours in keys as well, so positions carry over to the key frames
+        keys = np.unique(np.concatenate((i0, i0 + 1)))
+        local_q, local_p = decompose_transforms(local_t[keys])
+        pos = np.searchsorted(keys, i0) + (between - i0)
+        out[~exact] = compose_transforms(*sample_qt(local_q, local_p, pos), dtype=local_t.dtype)
+    return out
+
+def quat_mul(q1, q2):
+    # hamilton product of (..., 4) xyzw quaternions
+    x1, y1, z1, w1 = np.moveaxis(q1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(q2, -1, 0)
+    return np.stack((w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+                     w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2), axis=-1)
+
+def quat_conj(q):
+    return q * np.array([-1, -1, -1, 1], dtype=q.dtype)
+
+def quat_rotate(q, v):
+    # rotate (..., 3) vectors by unit (..., 4) xyzw quaternions
+    u, w = q[..., :3], q[..., 3:]
+    uv = np.cross(u, v)
+    return v + 2 * (w * uv + np.cross(u, uv))
+
+def quat_basis(q):
+    """
+    x and y basis vectors (first two rotation matrix columns) of unit xyzw quaternions.
+    """
+    x, y, z, w = np.moveaxis(q, -1, 0)
+    x_basis = np.stack((1 - 2 * (y * y + z * z), 2 * (x * y + w * z), 2 * (x * z - w * y)), axis=-1)
+    y_basis = np.stack((2 * (x * y - w * z), 1 - 2 * (x * x + z * z), 2 * (y * z + w * x)), axis=-1)
+    return x_basis, y_basis
+
+def decompose_transforms(mat, dtype=np.float64):
+    """
+    Split (..., 4, 4) rigid transforms into xyzw quaternions (..., 4) and translations (..., 3).
+    """
+    shape = mat.shape[:-2]
+    q = R.from_matrix(mat[..., :3, :3].reshape(-1, 3, 3)).as_quat().reshape(shape + (4,))
+    return q.astype(dtype, copy=False), mat[..., :3, 3].astype(dtype)
+
+def compose_transforms(q, p, dtype=np.float64):
+    """
+    Build (..., 4, 4) transforms from xyzw quaternions (..., 4) and translations (..., 3).
+    """
+    shape = q.shape[:-1]
+    mat = np.zeros(shape + (4, 4), dtype=dtype)
+    if q.size:
+        mat[..., :3, :3] = R.from_quat(q.reshape(-1, 4)).as_matrix().reshape(shape + (3, 3))
+    mat[..., :3, 3] = p
+    mat[..., 3, 3] = 1
+    return mat
+
 def RPY2Quat(roll, pitch, yaw):
     cy = np.cos(yaw * 0.5)
     sy = np.sin(yaw * 0.5)
@@ -71,24 +185,331 @@ def XZProjection(mat):
     out[:3, 3] = pos
     return out
 
+def decode_pose(pose, offsets, euler='ZYX', blender=False, dtype=np.float64):
+    """
+    Convert raw MOTION rows (T, C) into local transforms (T, J, 4, 4) of dtype.
+    All Euler triples of all frames are converted in a single scipy call, which
+    gives the same matrices as converting them one by one.
+    """
+    num_joints = offsets.shape[0]
+    length = pose.shape[0]
+
+    # + 1 for root pos ori + shift
+    if blender:
+        pose = pose.reshape(length, num_joints, 2, 3)
+        root = pose[:, 0]
+        joints_rot = pose[:, 1:, 1]
+        pose = np.concatenate((root, joints_rot), axis=1)
+    else:
+        pose = pose.reshape(length, num_joints + 1, 3)
+
+    local_t = np.zeros((length, num_joints, 4, 4), dtype=dtype)
+    if length == 0:
+        return local_t
+    rot = R.from_euler(euler, pose[:, 1:].reshape(-1, 3), degrees=True).as_matrix()
+    local_t[..., :3, :3] = rot.reshape(length, num_joints, 3, 3)
+    local_t[:, 0, :3, 3] = pose[:, 0]
+    local_t[:, 1:, :3, 3] = offsets[1:]
+    local_t[..., 3, 3] = 1
+    return local_t
+
+def matrix_to_euler(mat, euler='ZYX'):
+    """
+    Euler angles in degrees (N, 3) of rotation matrices (N, 3, 3), as R.from_matrix(mat).as_euler(euler, degrees=True).
+    Intrinsic orders of three different axes are solved in closed form, which is several times faster
+    than going through scipy's quaternions. Other orders and rows close to gimbal lock use scipy.
+    """
+    axes = ['XYZ'.find(axis) for axis in euler]
+    if not euler.isupper() or len(set(axes)) != 3 or -1 in axes:
+        return R.from_matrix(mat).as_euler(euler, degrees=True)
+    i, j, k = axes
+    # +1 for cyclic orders (XYZ, YZX, ZXY)
+    s = 1 if (j - i) % 3 == 1 else -1
+    cos_b = np.hypot(mat[:, i, i], mat[:, i, j])
+    angles = np.stack((np.arctan2(-s * mat[:, j, k], mat[:, k, k]),
+                       np.arctan2(s * mat[:, i, k], cos_b),
+                       np.arctan2(-s * mat[:, i, j], mat[:, i, i])), axis=-1)
+    angles = np.degrees(angles)
+    locked = cos_b < 1e-6
+    if np.any(locked):
+        angles[locked] = R.from_matrix(mat[locked]).as_euler(euler, degrees=True)
+    return angles
+
+def encode_pose(local_t, euler='ZYX', blender=False):
+    """
+    Inverse of decode_pose: raw MOTION rows (T, C) of local transforms (T, J, 4, 4).
+    All rotations of all frames are converted to Euler angles in a single scipy call.
+    """
+    length, num_joints = local_t.shape[:2]
+    rot = matrix_to_euler(local_t[..., :3, :3].reshape(-1, 3, 3), euler).reshape(length, num_joints, 3)
+    if blender:
+        # position and rotation channels on every joint, the positions of the other joints are their offsets
+        pose = np.stack((local_t[..., :3, 3], rot), axis=2)
+    else:
+        pose = np.concatenate((local_t[:, :1, :3, 3], rot), axis=1)
+    return pose.reshape(length, -1)
+
+def format_rows(values, precision=6):
+    """
+    Text of a 2D array, one row per line, as fixed-point numbers with `precision` decimals
+    padded to a common width. The characters of all numbers are computed as one uint8 array
+    instead of formatting the numbers one by one, which is what makes large MOTION blocks fast.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10 ** precision
+    q = np.round(np.abs(values) * scale).astype(np.int64)
+    whole, frac = np.divmod(q, scale)
+    # digit extraction is faster on 32-bit integers
+    frac = frac.astype(np.uint32)
+    if whole.max(initial=0) < 2 ** 32:
+        whole = whole.astype(np.uint32)
+    num_int = len(str(whole.max(initial=0)))
+    num_frac = precision + 1 if precision > 0 else 0
+    # sign + integer digits + '.' + fractional digits + separator
+    width = 1 + num_int + num_frac
+    out = np.full(values.shape + (width + 1,), ord(' '), dtype=np.uint8)
+
+    for k in range(precision):
+        out[..., width - 1 - k] = ord('0') + frac % 10
+        frac //= 10
+    if precision > 0:
+        out[..., width - num_frac] = ord('.')
+
+    # integer digits right to left, without leading zeros
+    units = width - num_frac - 1
+    num_digits = np.ones(values.shape, dtype=np.int64)
+    for k in range(1, num_int):
+        num_digits += whole >= 10 ** k
+    for k in range(num_int):
+        out[..., units - k] = np.where((whole > 0) | (k == 0), ord('0') + whole % 10, ord(' '))
+        whole //= 10
+    rows, cols = np.nonzero((values < 0) & (q > 0))
+    out[rows, cols, units - num_digits[rows, cols]] = ord('-')
+
+    out[:, -1, width] = ord('\n')
+    return out.tobytes().decode('ascii')
+
+def joint_levels(parents):
+    """
+    Group joint indices by depth in the hierarchy. The root is its own parent.
+    """
+    depth = np.zeros(len(parents), dtype=int)
+    for j in range(1, len(parents)):
+        depth[j] = depth[parents[j]] + 1
+    return [np.flatnonzero(depth == d) for d in range(1, depth.max(initial=0) + 1)]
+
+def forward_kinematics(local_t, parents, fix_root=True, levels=None):
+    """
+    World transforms (..., J, 4, 4) of local transforms (..., J, 4, 4) for all frames at once.
+    Joints of the same depth are composed with their parents in one batched matmul.
+    With fix_root the root is kept at the identity, otherwise it is its local transform.
+    levels is joint_levels(parents), for callers running FK on a few frames at a time.
+    """
+    world_t = np.zeros_like(local_t)
+    world_t[..., 0, :, :] = np.eye(4) if fix_root else local_t[..., 0, :, :]
+    for idx in levels if levels is not None else joint_levels(parents):
+        world_t[..., idx, :, :] = world_t[..., parents[idx], :, :] @ local_t[..., idx, :, :]
+    return world_t
+
+def forward_kinematics_qt(local_q, local_p, parents, fix_root=True):
+    """
+    forward_kinematics on quaternions (..., J, 4) and translations (..., J, 3).
+    """
+    world_q = np.empty_like(local_q)
+    world_p = np.empty_like(local_p)
+    if fix_root:
+        world_q[..., 0, :] = (0, 0, 0, 1)
+        world_p[..., 0, :] = 0
+    else:
+        world_q[..., 0, :] = local_q[..., 0, :]
+        world_p[..., 0, :] = local_p[..., 0, :]
+    for idx in joint_levels(parents):
+        parent_q = world_q[..., parents[idx], :]
+        world_q[..., idx, :] = quat_mul(parent_q, local_q[..., idx, :])
+        world_p[..., idx, :] = world_p[..., parents[idx], :] + quat_rotate(parent_q, local_p[..., idx, :])
+    return world_q, world_p
+
+def ancestor_levels(parents, joints):
+    """
+    joint_levels restricted to the strict ancestors of joints, the joints whose world rotations
+    the positions of joints need.
+    """
+    needed = np.zeros(len(parents), dtype=bool)
+    for j in np.asarray(joints).reshape(-1):
+        while j != 0 and not needed[parents[j]]:
+            j = parents[j]
+            needed[j] = True
+    return [idx[needed[idx]] for idx in joint_levels(parents) if needed[idx].any()]
+
+def position_chain(parents, joints):
+    """
+    The levels forward_positions visits, as (ancestors, others): the joints of the level whose
+    rotations the positions of joints need, and the other joints of joints on the level.
+    Also the slots of the joints in the rotation (..., K, ...) and position (..., K', 3) buffers, K and K'.
+    """
+    joints = np.asarray(joints).reshape(-1)
+    ancestors = np.concatenate([[0]] + ancestor_levels(parents, joints)).astype(np.int64)
+    chain = np.union1d(ancestors, joints)
+    rot_slot, pos_slot = np.zeros(len(parents), dtype=np.int64), np.zeros(len(parents), dtype=np.int64)
+    rot_slot[ancestors] = np.arange(len(ancestors))
+    pos_slot[chain] = np.arange(len(chain))
+    levels = []
+    for idx in joint_levels(parents):
+        idx = idx[np.isin(idx, chain)]
+        if len(idx):
+            inner = np.isin(idx, ancestors)
+            levels.append((idx[inner], idx[~inner]))
+    return levels, rot_slot, pos_slot, len(ancestors), len(chain)
+
+def gather_positions(world_p, pos_slot, joints):
+    # the buffer itself when it holds exactly joints, in order
+    if len(joints) == world_p.shape[-2] and np.array_equal(pos_slot[joints], np.arange(len(joints))):
+        return world_p
+    return np.ascontiguousarray(world_p[..., pos_slot[joints], :])
+
+def forward_positions(local_t, parents, joints, fix_root=True):
+    """
+    World positions (..., len(joints), 3) of some joints of local transforms (..., J, 4, 4),
+    the values of forward_kinematics without its (..., J, 4, 4) world transforms.
+    Only the ancestors of joints are composed, as [rotation | position] (..., 3, 4); the position
+    of every other joint is parent rotation @ offset + parent position.
+    """
+    joints = np.asarray(joints).reshape(-1)
+    levels, rot_slot, pos_slot, num_rot, num_pos = position_chain(parents, joints)
+    world = np.empty(local_t.shape[:-3] + (num_rot, 3, 4), dtype=local_t.dtype)
+    world_p = np.empty(local_t.shape[:-3] + (num_pos, 3), dtype=local_t.dtype)
+    world[..., 0, :, :] = np.eye(3, 4) if fix_root else local_t[..., 0, :3, :]
+    world_p[..., 0, :] = world[..., 0, :, 3]
+    offsets = local_t[..., :, 3]
+    for inner, outer in levels:
+        if len(inner):
+            composed = world[..., rot_slot[parents[inner]], :, :] @ local_t[..., inner, :, :]
+            world[..., rot_slot[inner], :, :] = composed
+            world_p[..., pos_slot[inner], :] = composed[..., 3]
+        if len(outer):
+            world_p[..., pos_slot[outer], :] = np.einsum('...ij,...j->...i', world[..., rot_slot[parents[outer]], :, :],
+                                                         offsets[..., outer, :])
+    return gather_positions(world_p, pos_slot, joints)
+
+def forward_positions_qt(local_q, local_p, parents, joints, fix_root=True):
+    """
+    forward_positions on quaternions (..., J, 4) and translations (..., J, 3).
+    """
+    joints = np.asarray(joints).reshape(-1)
+    levels, rot_slot, pos_slot, num_rot, num_pos = position_chain(parents, joints)
+    world_q = np.empty(local_q.shape[:-2] + (num_rot, 4), dtype=local_q.dtype)
+    world_p = np.empty(local_p.shape[:-2] + (num_pos, 3), dtype=local_p.dtype)
+    if fix_root:
+        world_q[..., 0, :], world_p[..., 0, :] = (0, 0, 0, 1), 0
+    else:
+        world_q[..., 0, :], world_p[..., 0, :] = local_q[..., 0, :], local_p[..., 0, :]
+    for inner, outer in levels:
+        if len(inner):
+            parent_q = world_q[..., rot_slot[parents[inner]], :]
+            world_p[..., pos_slot[inner], :] = world_p[..., pos_slot[parents[inner]], :] + quat_rotate(parent_q, local_p[..., inner, :])
+            world_q[..., rot_slot[inner], :] = quat_mul(parent_q, local_q[..., inner, :])
+        if len(outer):
+            world_p[..., pos_slot[outer], :] = world_p[..., pos_slot[parents[outer]], :] + \
+                quat_rotate(world_q[..., rot_slot[parents[outer]], :], local_p[..., outer, :])
+    return gather_positions(world_p, pos_slot, joints)
+
 class Animation:
-    def __init__(self):
+    def __init__(self, dtype=np.float64):
         self.name = None
+        # float type of the 4x4 transforms, load_bvh, resampling and FK keep it (float32 halves memory and bandwidth)
+        self.dtype = np.dtype(dtype)
         self.coord = None
         self.fps = 0
         self.length = 0
         self.joints = []
         self.parents = []
-        self.local_t = None
-        self.world_t = None
+        # joint offsets of the BVH hierarchy (J, 3)
+        self.offsets = None
+        self._local_t = None
+        self._world_t = None
+        # whole-take world_positions results by (fix_root, joints), dropped when the local transforms change
+        self._positions = {}
         self.world_vw = None
+        # compact mode: xyzw quaternions (T, J, 4) and translations (T, J, 3) instead of 4x4 matrices
+        self.local_q = None
+        self.local_p = None
+        self.world_q = None
+        self.world_p = None
 
-    def load_bvh(self, path, euler = 'ZYX', upsample = 1, ftrim=0, btrim=0, blender=False):
-        base = os.path.basename(path)
-        self.name = os.path.splitext(base)[0]
-        bvh = open(path, 'r')
-        
-        pose = []
+    @property
+    def is_compact(self):
+        return self.local_q is not None
+
+    @property
+    def local_t(self):
+        # in compact mode the 4x4 matrices are built on request and not kept
+        if self._local_t is None and self.local_q is not None:
+            return compose_transforms(self.local_q, self.local_p, self.dtype)
+        return self._local_t
+
+    @local_t.setter
+    def local_t(self, value):
+        self._local_t = value
+        self.local_q = self.local_p = None
+        self._positions = {}
+
+    @property
+    def world_t(self):
+        if self._world_t is None and self.world_q is not None:
+            return compose_transforms(self.world_q, self.world_p, self.dtype)
+        return self._world_t
+
+    @world_t.setter
+    def world_t(self, value):
+        self._world_t = value
+        self.world_q = self.world_p = None
+
+    def to_compact(self, dtype=np.float32):
+        """
+        Switch to quaternion + translation storage (7 values per joint and frame instead of 16).
+        local_t / world_t stay readable and are materialized on access.
+        """
+        if self._local_t is not None:
+            self.local_q, self.local_p = decompose_transforms(self._local_t, dtype)
+            self._local_t = None
+        elif self.local_q is not None:
+            self.local_q, self.local_p = self.local_q.astype(dtype), self.local_p.astype(dtype)
+        self._positions = {}
+        if self._world_t is not None:
+            self.world_q, self.world_p = decompose_transforms(self._world_t, dtype)
+            self._world_t = None
+        elif self.world_q is not None:
+            self.world_q, self.world_p = self.world_q.astype(dtype), self.world_p.astype(dtype)
+
+    def to_dense(self):
+        if self.local_q is not None:
+            self.local_t = self.local_t
+        if self.world_q is not None:
+            self.world_t = self.world_t
+
+    def _update_length(self):
+        self.length = (self.local_q if self.is_compact else self._local_t).shape[0]
+        # every change of the local transforms ends here, copies get their own cache
+        self._positions = {}
+
+    def select_frames(self, index):
+        # slice/index the frame axis of whichever representation is in use
+        if self.is_compact:
+            self.local_q, self.local_p = self.local_q[index], self.local_p[index]
+        else:
+            self._local_t = self._local_t[index]
+        if self.world_q is not None:
+            self.world_q, self.world_p = self.world_q[index], self.world_p[index]
+        elif self._world_t is not None:
+            self._world_t = self._world_t[index]
+        self._update_length()
+
+    def read_header(self, bvh):
+        """
+        Parse the HIERARCHY and the MOTION header of an open BVH file, leaving it at the first pose row.
+        Sets joints, parents, length (as declared by Frames:) and fps, returns the joint offsets.
+        """
+        self.joints, self.parents = [], []
         offsets = []
         current_joint = 0
         end_site = False
@@ -127,88 +548,194 @@ class Animation:
 
             if "Frame Time:" in line:
                 self.fps = round(1 / float(line.split(' ')[-1]))
-                continue
+                break
 
             if "HIERARCHY" in line or "{" in line or "CHANNELS" in line or "MOTION" in line:
                 continue
 
-            pose.append(np.array(line.strip().split(' ')))
-        
         self.joints = np.asarray(self.joints, dtype=str)
         self.parents = np.asarray(self.parents, dtype=np.int8)
-        
-        pose = np.asarray(pose, dtype=np.float32)
         offsets = np.asarray(offsets, dtype=np.float32)
-        
-        # + 1 for root pos ori + shift
-        if blender:
-            pose = pose.reshape(self.length, self.joints.shape[0], 2, 3)
-            root = pose[:, 0]
-            joints = pose[:, 1:]
-            joints_rot = joints[:, :, 1]
-            pose = np.concatenate((root, joints_rot), axis=1)
-        else:
-            pose = pose.reshape(self.length, self.joints.shape[0] + 1, 3)
-
-        self.length = pose.shape[0]
-        self.local_t = np.zeros((self.length, self.joints.shape[0], 4, 4))
-        for f in range(self.length):
-            for j in range(1, self.joints.shape[0] + 1):
-                local_t_mat = np.eye(4)
-                r = R.from_euler(euler, pose[f, j], degrees=True)
-                p = pose[f, 0] if j == 1 else offsets[j - 1]
-                local_t_mat[:3, 3] = p
-                local_t_mat[:3, :3] = r.as_matrix()
-                self.local_t[f, j - 1] = local_t_mat
-                
+        self.offsets = offsets
+        return offsets
+
+    def load_bvh(self, path, euler = 'ZYX', upsample = 1, ftrim=0, btrim=0, blender=False, cache=None):
+        base = os.path.basename(path)
+        self.name = os.path.splitext(base)[0]
+
+        # cache=None uses the cache configured by ELMO_BVH_CACHE (if any), False disables it
+        if cache is None:
+            cache = get_default_cache()
+        cache_params = dict(euler=euler, upsample=upsample, ftrim=ftrim, btrim=btrim, blender=blender, dtype=self.dtype.name)
+        if cache and cache.restore(self, path, **cache_params):
+            print(f'Loaded {self.length} frames from {path} (cached)')
+            return
+
+        with profiler.stage('parse', file=path):
+            bvh = open(path, 'r')
+            offsets = self.read_header(bvh)
+
+            # the rest of the file is the MOTION block, parsed as one numeric array
+            pose = np.loadtxt(bvh, dtype=np.float32, ndmin=2)
+            bvh.close()
+
+            self.local_t = decode_pose(pose, offsets, euler=euler, blender=blender, dtype=self.dtype)
+            self.length = self.local_t.shape[0]
+
         # trim
-        self.local_t = self.local_t[ftrim:-btrim] if btrim > 0 else self.local_t[ftrim:]
-        self.length = self.local_t.shape[0]
-        
-        # upsample by lerp and slerp
-        if upsample > 1:
-            new_local_t = np.zeros(((self.length - 1) * upsample, self.joints.shape[0], 4, 4))
-            for f in range(self.length - 1):
-                for j in range(self.joints.shape[0]):
-                    for k in range(upsample):
-                        local_t_interp = np.eye(4)
-                        local_t_0 = self.local_t[f, j]
-                        local_t_1 = self.local_t[f + 1, j]
-                        t = k / upsample
-                        
-                        p_lerp = compute_p_lerp(local_t_0, local_t_1, t)
-                        r_slerp = compute_r_slerp(local_t_0, local_t_1, t)
-                        
-                        local_t_interp[:3, 3] = p_lerp
-                        local_t_interp[:3, :3] = r_slerp.as_matrix()
-                        new_local_t[f * upsample + k, j] = local_t_interp       
-            self.local_t = new_local_t
-        elif upsample < -1: # downsample
-            self.local_t = self.local_t[::abs(upsample)]
-        else:
-            pass
-        self.length = self.local_t.shape[0]
+        with profiler.stage('trim', file=path):
+            self.trim(ftrim, btrim)
+
+        # upsample by lerp and slerp, or downsample by striding
+        with profiler.stage('resample', file=path):
+            self.resample(upsample)
+
+        if cache:
+            cache.store(self, path, **cache_params)
 
         print(f'Loaded {self.length} frames from {path}')
 
+    def iter_bvh(self, path, chunk_size=1024, euler='ZYX', ftrim=0, btrim=0, step=1, frames=None, blender=False,
+                 compact=False, dtype=np.float32):
+        """
+        Stream the MOTION section of a BVH file in chunks of at most chunk_size frames, for takes too long to load.
+        Frames are selected on the fly: trim by ftrim/btrim, then keep frames[0]:frames[1] of the
+        trimmed take (None for the whole take), then every step-th frame. Unselected rows are never parsed.
+        Header fields (joints, parents, fps) are set on self and length is the number of selected frames.
+        Yields local transforms (n, J, 4, 4) of self.dtype, or (quaternions (n, J, 4), translations (n, J, 3))
+        in dtype with compact=True. Concatenated, the chunks equal load_bvh(path, ftrim=ftrim, btrim=btrim, upsample=-step).
+        """
+        base = os.path.basename(path)
+        self.name = os.path.splitext(base)[0]
+        with open(path, 'r') as bvh:
+            offsets = self.read_header(bvh)
+
+            start, stop = ftrim, self.length - btrim
+            if frames is not None:
+                range_start, range_stop = frames
+                stop = stop if range_stop is None else min(stop, start + range_stop)
+                start += range_start or 0
+            stop = max(stop, start)
+            self.length = len(range(start, stop, step))
+
+            rows = itertools.islice(bvh, start, stop, step)
+            while True:
+                lines = list(itertools.islice(rows, chunk_size))
+                if not lines:
+                    break
+                pose = np.loadtxt(lines, dtype=np.float32, ndmin=2)
+                local_t = decode_pose(pose, offsets, euler=euler, blender=blender, dtype=self.dtype)
+                yield decompose_transforms(local_t, dtype) if compact else local_t
+
+    def save_bvh(self, path, euler='ZYX', blender=False, precision=6):
+        """
+        Write the animation as a BVH file that load_bvh reads back with the same euler and blender
+        arguments. Rotations are converted to Euler angles in one call and the MOTION block is
+        formatted in bulk by format_rows, with `precision` decimals.
+        """
+        if not self.fps or self.fps <= 0:
+            raise ValueError(f'Cannot write {path}: the animation has no frame rate (fps={self.fps!r}), set Animation.fps')
+        offsets = np.zeros((len(self.joints), 3)) if self.offsets is None else np.array(self.offsets, dtype=np.float64)
+        # built once: in compact mode every access composes the dense matrices again
+        local_t = self.local_t if self.length > 0 else None
+        if local_t is not None:
+            # the loaded offsets of the other joints live in the local translations
+            offsets[1:] = local_t[0, 1:, :3, 3]
+        channels = ' '.join(axis + 'rotation' for axis in euler.upper())
+        children = [[] for _ in self.joints]
+        for j in range(1, len(self.joints)):
+            children[self.parents[j]].append(j)
+
+        lines = ['HIERARCHY']
+        def write_joint(j, depth):
+            indent = '\t' * depth
+            lines.append(f"{indent}{'ROOT' if j == 0 else 'JOINT'} {self.joints[j]}")
+            lines.append(indent + '{')
+            lines.append(f'{indent}\tOFFSET %.{precision}f %.{precision}f %.{precision}f' % tuple(offsets[j]))
+            if j == 0 or blender:
+                lines.append(f'{indent}\tCHANNELS 6 Xposition Yposition Zposition {channels}')
+            else:
+                lines.append(f'{indent}\tCHANNELS 3 {channels}')
+            for c in children[j]:
+                write_joint(c, depth + 1)
+            if not children[j]:
+                lines.extend([f'{indent}\tEnd Site', indent + '\t{', f'{indent}\t\tOFFSET 0 0 0', indent + '\t}'])
+            lines.append(indent + '}')
+        write_joint(0, 0)
+        lines += ['MOTION', f'Frames: {self.length}', f'Frame Time: {1 / self.fps:.8f}']
+
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+            if local_t is not None:
+                f.write(format_rows(encode_pose(local_t, euler=euler, blender=blender), precision))
+
+    def trim(self, ftrim=0, btrim=0):
+        self.select_frames(slice(ftrim, -btrim if btrim > 0 else None))
+
+    def resample(self, upsample):
+        # upsample > 1 interpolates new frames, upsample < -1 keeps every |upsample|-th frame
+        if upsample > 1:
+            self.interp_upsample(upsample)
+        elif upsample < -1:
+            self.select_frames(slice(None, None, abs(upsample)))
+
+    def sample(self, frames):
+        """
+        Keep the poses at fractional frame positions (K,): integer positions are copied,
+        the others slerped/lerped between their neighbours. World transforms are dropped.
+        """
+        if self.is_compact:
+            local_q, local_p = sample_qt(self.local_q, self.local_p, frames)
+            self.local_q, self.local_p = local_q.astype(self.local_q.dtype), local_p.astype(self.local_p.dtype)
+        else:
+            self.local_t = sample_transforms(self.local_t, frames)
+        self._world_t = self.world_q = self.world_p = None
+        self._update_length()
+
     def compute_world_transform(self, fix_root = True):
-        self.world_t = np.zeros((self.length, self.joints.shape[0], 4, 4))
-        for f in range(self.length):
-            self.world_t[f, 0] = np.eye(4)
-            
-            start_idx = 0
-            if fix_root:
-                start_idx = 1
-            
-            for j in range(start_idx, self.joints.shape[0]):
-                local_t = self.local_t[f, j]
-                self.world_t[f, j] = np.matmul(self.world_t[f, self.parents[j]], local_t)
+        if self.is_compact:
+            self.world_q, self.world_p = forward_kinematics_qt(self.local_q, self.local_p, self.parents, fix_root=fix_root)
+            self._world_t = None
+        else:
+            self.world_t = forward_kinematics(self.local_t, self.parents, fix_root=fix_root)
                 
+    def world_positions(self, joints=None, frames=slice(None), fix_root=True):
+        """
+        World positions (T, K, 3) of joints (K indices, all by default) at frames (a slice or indices),
+        without compute_world_transform: only the requested joints and their ancestors are composed,
+        on the requested frames only. fix_root as compute_world_transform.
+        Queries over the whole take are cached by fix_root and joints and are read-only; other frames
+        (e.g. the chunks of a chunked evaluation) are composed on every call and not kept.
+        """
+        joints = np.arange(len(self.parents)) if joints is None else np.asarray(joints, dtype=np.int64).reshape(-1)
+        num_frames = (self.local_q if self.is_compact else self._local_t).shape[0]
+        whole = isinstance(frames, slice) and frames.indices(num_frames) == (0, num_frames, 1)
+        key = (bool(fix_root), joints.tobytes())
+        if whole and key in self._positions:
+            return self._positions[key]
+        if self.is_compact:
+            pos = forward_positions_qt(self.local_q[frames], self.local_p[frames], self.parents, joints, fix_root)
+        else:
+            pos = forward_positions(self.local_t[frames], self.parents, joints, fix_root)
+        if whole:
+            pos.flags.writeable = False
+            self._positions[key] = pos
+        return pos
+
     def dup_upsample(self, n):
         # duplicate each frame n times
-        dup_local_t = np.zeros((self.length * n, self.joints.shape[0], 4, 4))
-        for f in range(self.length):
-            for i in range(n):
-                dup_local_t[f * n + i] = self.local_t[f]
-        self.local_t = dup_local_t
-        self.length = self.local_t.shape[0]
\ No newline at end of file
+        if self.is_compact:
+            self.local_q = np.repeat(self.local_q, n, axis=0)
+            self.local_p = np.repeat(self.local_p, n, axis=0)
+        else:
+            self.local_t = np.repeat(self.local_t, n, axis=0)
+        self._update_length()
+
+    def interp_upsample(self, n):
+        # interpolate n frames between consecutive frames (lerp + slerp)
+        if self.is_compact:
+            local_q, local_p = interp_upsample_qt(self.local_q, self.local_p, n)
+            self.local_q, self.local_p = local_q.astype(self.local_q.dtype), local_p.astype(self.local_p.dtype)
+        else:
+            self.local_t = interp_upsample(self.local_t, n)
+        self._update_length()
\ No newline at end of file
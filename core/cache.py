@@ -0,0 +1,171 @@
+import os
+import glob
+import hashlib
+import argparse
+import numpy as np
+
+# bump when the layout of the cached arrays changes
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = './datasets/.bvh_cache'
+DEFAULT_MAX_MB = 4096
+
+
+class BVHCache:
+    """
+    On-disk cache of parsed animations, one .npz per (file, load arguments).
+    Entries are keyed by the absolute source path, its mtime and size and every
+    argument of Animation.load_bvh that changes the result (and the Animation dtype), so editing a BVH or
+    loading it differently never returns a stale entry.
+    Least recently used entries are evicted once the directory exceeds max_mb, when the cache
+    is opened and after every store (never the entry just written).
+    """
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        # a cache left over budget (e.g. by a smaller max_mb) shrinks even if it only gets hits
+        if os.path.isdir(root):
+            self.evict()
+
+    def key(self, path, euler='ZYX', upsample=1, ftrim=0, btrim=0, blender=False, dtype='float64'):
+        st = os.stat(path)
+        desc = '|'.join(str(x) for x in (CACHE_VERSION, os.path.abspath(path), st.st_mtime_ns, st.st_size,
+                                          euler, upsample, ftrim, btrim, blender, dtype))
+        return hashlib.sha1(desc.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.root, key + '.npz')
+
+    def restore(self, anim, path, **params):
+        """
+        Fill anim from the cache. Returns False on a miss.
+        """
+        entry = self.entry_path(self.key(path, **params))
+        if not os.path.exists(entry):
+            return False
+        try:
+            with np.load(entry) as data:
+                anim.joints = data['joints']
+                anim.parents = data['parents']
+                anim.offsets = data['offsets']
+                anim.fps = int(data['fps'])
+                anim.local_t = data['local_t']
+        except (OSError, ValueError, KeyError):
+            # truncated or foreign file, treat as a miss and let it be rewritten
+            return False
+        anim.length = anim.local_t.shape[0]
+        # refresh mtime so eviction is least recently used (unless another process evicted it meanwhile)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def store(self, anim, path, **params):
+        os.makedirs(self.root, exist_ok=True)
+        entry = self.entry_path(self.key(path, **params))
+        # write next to the target and rename, so concurrent readers never see a partial file
+        tmp = f'{entry}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, joints=anim.joints, parents=anim.parents, offsets=anim.offsets, fps=anim.fps, local_t=anim.local_t)
+        os.replace(tmp, entry)
+        self.evict(keep=entry)
+
+    def entries(self):
+        return glob.glob(os.path.join(self.root, '*.npz'))
+
+    def stats(self):
+        """
+        (path, mtime, size) of every entry. Entries removed meanwhile by another process are skipped.
+        """
+        stats = []
+        for entry in self.entries():
+            try:
+                st = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            stats.append((entry, st.st_mtime, st.st_size))
+        return stats
+
+    def size(self):
+        return sum(size for _, _, size in self.stats())
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in max_mb, except keep.
+        Other processes may store and evict in the same directory, entries they remove are skipped.
+        """
+        stats = sorted(self.stats(), key=lambda x: x[1])
+        total = sum(size for _, _, size in stats)
+        keep = os.path.abspath(keep) if keep is not None else None
+        for entry, _, size in stats:
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(entry) == keep:
+                continue
+            total -= size
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in self.entries():
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+
+_default_caches = {}
+
+
+def get_default_cache():
+    """
+    Cache enabled through the environment, or None.
+    ELMO_BVH_CACHE sets the cache directory, ELMO_BVH_CACHE_MAX_MB its size bound.
+    The cache is opened (and shrunk to its bound) once per process.
+    """
+    root = os.environ.get('ELMO_BVH_CACHE')
+    if not root:
+        return None
+    max_mb = float(os.environ.get('ELMO_BVH_CACHE_MAX_MB', DEFAULT_MAX_MB))
+    if (root, max_mb) not in _default_caches:
+        _default_caches[root, max_mb] = BVHCache(root, max_mb)
+    return _default_caches[root, max_mb]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm or clear the parsed BVH cache.')
+    parser.add_argument('command', choices=['warm', 'clear', 'info'])
+    parser.add_argument('paths', nargs='*', help='BVH files or directories to warm')
+    parser.add_argument('--dir', type=str, default=os.environ.get('ELMO_BVH_CACHE', DEFAULT_CACHE_DIR), help='Cache directory')
+    parser.add_argument('--max-mb', type=float, default=float(os.environ.get('ELMO_BVH_CACHE_MAX_MB', DEFAULT_MAX_MB)), help='Cache size bound in MB')
+    parser.add_argument('--euler', type=str, default='ZYX')
+    parser.add_argument('--upsample', type=int, default=1)
+    parser.add_argument('--ftrim', type=int, default=0)
+    parser.add_argument('--btrim', type=int, default=0)
+    parser.add_argument('--blender', action='store_true')
+    parser.add_argument('--dtype', type=str, default='float64', choices=['float32', 'float64'])
+    args = parser.parse_args()
+
+    cache = BVHCache(args.dir, args.max_mb)
+    if args.command == 'clear':
+        n = len(cache.entries())
+        cache.clear()
+        print(f'Removed {n} entries from {args.dir}')
+    elif args.command == 'info':
+        print(f'{len(cache.entries())} entries, {cache.size() / 1024 / 1024:.1f} MB in {args.dir}')
+    else:
+        # imported here, core.animation imports this module
+        import core.animation as anim
+        from core.utils import get_bvh_filepaths
+
+        paths = []
+        for path in args.paths:
+            paths += get_bvh_filepaths(path) if os.path.isdir(path) else [path]
+        for path in sorted(paths):
+            anim.Animation(dtype=args.dtype).load_bvh(path, euler=args.euler, upsample=args.upsample, ftrim=args.ftrim,
+                                      btrim=args.btrim, blender=args.blender, cache=cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import json
+import argparse
+import h5py
+import core.animation as anim
+
+DEFAULT_ROOTS = ['./datasets/ELMO_dataset', './datasets/MOVIN_dataset']
+DEFAULT_CATALOG = './datasets/catalog.json'
+
+
+def parse_subject(subject):
+    """
+    Height and gender tag of a subject directory name, e.g. 1201_172_W (ELMO) or 162_F (MOVIN).
+    """
+    parts = subject.split('_')
+    height = int(parts[-2]) if len(parts) >= 2 and parts[-2].isdigit() else None
+    return height, parts[-1] if len(parts) >= 2 else None
+
+
+def file_state(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_bvh_info(path):
+    """
+    Frame count and fps from the BVH header, the MOTION rows are not read.
+    """
+    motion = anim.Animation()
+    with open(path, 'r') as bvh:
+        motion.read_header(bvh)
+    return {'bvh_frames': motion.length, 'fps': motion.fps}
+
+
+def read_h5_info(path):
+    """
+    Frame count and number of frames without a point cloud, from the HDF5 structure only.
+    """
+    with h5py.File(path, 'r') as f:
+        if 'frame_offsets' in f:
+            missing = f['missing'][()]
+            return {'lidar_frames': len(missing), 'lidar_missing': int(missing.sum())}
+        keys = list(f.keys())
+        return {'lidar_frames': len(keys), 'lidar_missing': sum('pointcloud' not in f[key] for key in keys)}
+
+
+def scan_take(record, previous=None):
+    """
+    Fill the BVH and LiDAR fields of a take record, reusing previous when its files did not change.
+    """
+    if previous is not None and previous.get('bvh_state') == record['bvh_state'] and previous.get('h5_state') == record['h5_state']:
+        return dict(previous, **record)
+    record.update({'bvh_frames': None, 'fps': None, 'lidar_frames': None, 'lidar_missing': None})
+    if record['bvh']:
+        record.update(read_bvh_info(record['bvh']))
+    if record['h5']:
+        record.update(read_h5_info(record['h5']))
+    return record
+
+
+def find_takes(root):
+    """
+    Take records of a <root>/<split>/<subject>/{mocap,lidar}/<take>.{bvh,h5} tree, without the file contents.
+    """
+    dataset = os.path.basename(os.path.normpath(root)).replace('_dataset', '')
+    records = []
+    for split in sorted(os.listdir(root)):
+        split_dir = os.path.join(root, split)
+        if not os.path.isdir(split_dir):
+            continue
+        for subject in sorted(os.listdir(split_dir)):
+            subject_dir = os.path.join(split_dir, subject)
+            if not os.path.isdir(subject_dir):
+                continue
+            files = {}
+            for kind, ext in (('bvh', '.bvh'), ('h5', '.h5')):
+                kind_dir = os.path.join(subject_dir, 'mocap' if kind == 'bvh' else 'lidar')
+                if os.path.isdir(kind_dir):
+                    for file in os.listdir(kind_dir):
+                        if file.endswith(ext):
+                            files.setdefault(os.path.splitext(file)[0], {})[kind] = os.path.join(kind_dir, file)
+            height, gender = parse_subject(subject)
+            for take in sorted(files):
+                bvh, h5 = files[take].get('bvh'), files[take].get('h5')
+                records.append({
+                    'dataset': dataset, 'split': split, 'subject': subject, 'height': height, 'gender': gender,
+                    'take': take, 'bvh': bvh, 'h5': h5,
+                    'bvh_state': file_state(bvh) if bvh else None, 'h5_state': file_state(h5) if h5 else None,
+                })
+    return records
+
+
+def build_catalog(roots=DEFAULT_ROOTS, previous=None):
+    """
+    Scan the dataset trees, reading only BVH headers and HDF5 structure. With a previous catalog,
+    takes whose files have the same mtime and size are taken from it instead of being read again.
+    """
+    known = {} if previous is None else {(r['bvh'], r['h5']): r for r in previous.records}
+    records = []
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        records += [scan_take(record, known.get((record['bvh'], record['h5']))) for record in find_takes(root)]
+    return Catalog(records)
+
+
+class Catalog:
+    """
+    One record per take: dataset, split, subject, height, gender, take, bvh, h5,
+    bvh_frames, fps, lidar_frames, lidar_missing (None when the file is absent).
+
+        catalog = Catalog.load()
+        catalog.select(split='test', take='Locomotion')
+        catalog.select(dataset='ELMO', gender=('F', 'W'))
+    """
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def select(self, **criteria):
+        """
+        Records matching all criteria, each a value, a list/tuple/set of accepted values or a predicate.
+        """
+        def match(record, key, value):
+            if callable(value):
+                return value(record[key])
+            if isinstance(value, (list, tuple, set)):
+                return record[key] in value
+            return record[key] == value
+        return Catalog([r for r in self.records if all(match(r, k, v) for k, v in criteria.items())])
+
+    def values(self, key):
+        return [r[key] for r in self.records]
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.records)
+
+    def save(self, path=DEFAULT_CATALOG):
+        with open(path, 'w') as f:
+            json.dump({'records': self.records}, f, indent=1)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CATALOG):
+        with open(path, 'r') as f:
+            return cls(json.load(f)['records'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the catalog of the ELMO and MOVIN datasets.')
+    parser.add_argument('command', choices=['build', 'list'])
+    parser.add_argument('roots', nargs='*', default=DEFAULT_ROOTS, help='Dataset directories to scan (build)')
+    parser.add_argument('--catalog', type=str, default=DEFAULT_CATALOG, help='Catalog file')
+    parser.add_argument('--rescan', action='store_true', help='Read every file again instead of reusing unchanged entries')
+    parser.add_argument('--dataset', type=str, nargs='*')
+    parser.add_argument('--split', type=str, nargs='*')
+    parser.add_argument('--subject', type=str, nargs='*')
+    parser.add_argument('--gender', type=str, nargs='*')
+    parser.add_argument('--take', type=str, nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        previous = None
+        if not args.rescan and os.path.exists(args.catalog):
+            previous = Catalog.load(args.catalog)
+        catalog = build_catalog(args.roots, previous)
+        catalog.save(args.catalog)
+        print(f'Saved {len(catalog)} takes to {args.catalog}')
+        return
+
+    catalog = Catalog.load(args.catalog)
+    criteria = {key: getattr(args, key) for key in ('dataset', 'split', 'subject', 'gender', 'take') if getattr(args, key)}
+    for r in catalog.select(**criteria):
+        print(f"{r['dataset']:6s} {r['split']:6s} {r['subject']:12s} {r['take']:12s} "
+              f"bvh {r['bvh_frames']} @ {r['fps']} Hz  lidar {r['lidar_frames']} ({r['lidar_missing']} missing)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import os
+import json
+import argparse
+import numpy as np
+import core.animation as anim
+from core.utils import match_length, summarize_err, calculate_average_error, calculate_metric_average, parallel_map, \
+    err_deviation, ERR_NAMES
+from core.metrics import MetricEngine, BASE_METRICS
+from core.profiling import profiler, call_with_records
+from core.results import MetricStore
+from core.alignment import Alignment
+
+
+def load_config(path):
+    """
+    Read an evaluation config (JSON). Keys:
+        name         : name of the evaluation
+        data_path    : directory holding GT and model output BVH files
+        result_path  : where the CSVs go (default: './datasets/evaluation_dataset/results/' + data_path)
+        blender      : BVH files store 6 channels per joint
+        gt           : {"ftrim", "btrim", "upsample", "fps"} applied to the GT files
+        variants     : list of {"name", "title", "tag", "ftrim", "btrim", "upsample", "dup", "fps"}, in report order.
+                       Files whose name contains "tag" are the model outputs of that variant, all other
+                       files are GT. Several variants can share a tag, the file is then parsed only once.
+        print_pelvis : also print pelvis errors (default true)
+        chunk_size   : compute the metrics in chunks of this many frames (default: whole sequence)
+        dtype        : "float64" (default) or "float32", float type of the transforms and metrics
+        metrics      : names of core.metrics.METRICS reported next to the inference_err ones, e.g.
+                       ["geodesic", "pa_mpjpe", "jerk", "foot_skate"] (default none)
+        metric_params: parameters of the metrics, overriding core.metrics.DEFAULT_PARAMS, e.g.
+                       {"foot_joints": ["LeftFoot", "LeftToe", "RightFoot", "RightToe"]} (default none)
+        store        : SQLite file keeping the per-file metrics between runs, only new or changed files
+                       are evaluated again (default: <result_path>/metrics.sqlite, null disables it)
+        rule         : decoration around the variant titles in the report
+    """
+    with open(path, 'r') as f:
+        config = json.load(f)
+    config.setdefault('result_path', './datasets/evaluation_dataset/results/' + config['data_path'])
+    config.setdefault('blender', False)
+    config.setdefault('gt', {})
+    config.setdefault('print_pelvis', True)
+    config.setdefault('rule', '----------')
+    config.setdefault('chunk_size', None)
+    config.setdefault('dtype', 'float64')
+    config.setdefault('metrics', [])
+    config.setdefault('metric_params', {})
+    config.setdefault('store', os.path.join(config['result_path'], 'metrics.sqlite'))
+    return config
+
+def get_tags(config):
+    tags = []
+    for variant in config['variants']:
+        if variant['tag'] not in tags:
+            tags.append(variant['tag'])
+    return tags
+
+def find_files(config):
+    """
+    Sorted GT paths and sorted model output paths per tag.
+    """
+    tags = get_tags(config)
+    gt_paths, tag_paths = [], {tag: [] for tag in tags}
+    for root, dirs, files in os.walk(config['data_path']):
+        for file in files:
+            if not file.endswith(".bvh"):
+                continue
+            file_path = os.path.join(root, file)
+            filename = os.path.splitext(file)[0]
+            tag = next((tag for tag in tags if tag in filename), None)
+            if tag is None:
+                gt_paths.append(file_path)
+            else:
+                tag_paths[tag].append(file_path)
+
+    gt_paths.sort()
+    for paths in tag_paths.values():
+        paths.sort()
+    return gt_paths, tag_paths
+
+def derive(source, ftrim=0, btrim=0, upsample=1, dup=1, fps=None, name='gt', file=None, **kwargs):
+    """
+    Trimmed and resampled copy of an already parsed animation, same as load_bvh with these arguments.
+    fps samples the trimmed motion at that rate by timestamp (fps 20: the poses at the LiDAR frames).
+    name and file only label the profile records.
+    """
+    motion = anim.copy(source)
+    with profiler.stage('trim', file=file, variant=name):
+        motion.trim(ftrim, btrim)
+    with profiler.stage('resample', file=file, variant=name):
+        motion.resample(upsample)
+        if fps is not None and fps != motion.fps:
+            motion = Alignment.of(motion, lidar_fps=fps).resample(motion)
+        if dup > 1:
+            motion.dup_upsample(dup)
+    return motion
+
+def prepare_group(config, gt_path, source_paths):
+    """
+    Parse the GT file and its model outputs (each once) and derive the GT and every variant,
+    cut to a common length. Returns the GT and the outputs in variant order.
+    Stages are profiled under the GT path and the variant ('gt' for the GT), a model output
+    being parsed under the first variant using it.
+    """
+    parsed = {}
+    def parse(path):
+        if path not in parsed:
+            parsed[path] = anim.Animation(dtype=config['dtype'])
+            parsed[path].load_bvh(path, blender=config['blender'])
+        return parsed[path]
+
+    with profiler.scope(file=gt_path, variant='gt'):
+        gt = derive(parse(gt_path), **config['gt'])
+    outputs = []
+    for variant in config['variants']:
+        with profiler.scope(file=gt_path, variant=variant['name']):
+            outputs.append(derive(parse(source_paths[variant['tag']]), **variant))
+
+    with profiler.stage('match_length', file=gt_path, variant='all'):
+        match_length([gt] + outputs)
+    return gt, outputs
+
+def evaluate_group(config, gt_path, source_paths):
+    """
+    Score all variants of one GT file. Every source file is parsed once. No world transforms
+    are built: the metrics compute the world positions they need (Animation.world_positions), and
+    without chunk_size those of the GT once for all variants (chunks are composed per variant and
+    not kept). The inference_err metrics and the extra metrics of the config are computed in one
+    MetricEngine pass; its profile stage 'inference_err' includes that FK (the whole-take GT
+    positions in the first variant's).
+    Returns the file name, the joint names, {variant name: inference_err tuple} and
+    {variant name: {extra metric: per-joint average}}.
+    """
+    gt, outputs = prepare_group(config, gt_path, source_paths)
+    engine = MetricEngine(BASE_METRICS + tuple(config['metrics']), chunk_size=config['chunk_size'],
+                          **config['metric_params'])
+
+    metrics, extra = {}, {}
+    for variant, output in zip(config['variants'], outputs):
+        with profiler.stage('inference_err', file=gt_path, variant=variant['name']):
+            sums, counts = engine.sums(output, gt)
+            metrics[variant['name']] = summarize_err(*(sums[name] for name in BASE_METRICS), output.length)
+            extra[variant['name']] = {name: sums[name] / counts[name] for name in config['metrics']}
+
+    file_name = os.path.splitext(os.path.basename(gt_path))[0]
+    joint_names = np.insert(gt.joints, 0, 'length')
+    return file_name, joint_names, metrics, extra
+
+def evaluate_groups(jobs, workers=1):
+    """
+    evaluate_group over the jobs, over a process pool when workers > 1.
+    """
+    if not (profiler.enabled and workers > 1):
+        return parallel_map(evaluate_group, jobs, workers)
+    # records made in the worker processes come back with the results
+    results = []
+    for result, records in parallel_map(call_with_records, [(evaluate_group,) + job for job in jobs], workers):
+        results.append(result)
+        profiler.records += records
+    return results
+
+def precision_report(config, results, references):
+    """
+    Print the maximum deviation of every inference_err output from the float64 reference over all files,
+    per variant. Returns {variant name: {output name: (deviation, file name)}}.
+    """
+    report = {}
+    for variant in config['variants']:
+        worst = {}
+        for result, reference in zip(results, references):
+            file_name, metrics, reference = result[0], result[2], reference[2]
+            for key, value in err_deviation(metrics[variant['name']], reference[variant['name']]).items():
+                if key not in worst or value > worst[key][0]:
+                    worst[key] = (value, file_name)
+        report[variant['name']] = worst
+        print(f"{config['dtype']} vs float64, {variant.get('title', variant['name'])}: max deviation over {len(results)} files")
+        for key in ERR_NAMES[:-1]:
+            print(f'    {key:18s} {worst[key][0]:.3g} ({worst[key][1]})')
+    return report
+
+def run_evaluation(config, workers=1, profile_path=None, recompute=False, check_precision=False):
+    """
+    Evaluate every variant of the config over all files, write the per-joint CSVs and print the report.
+    Returns {variant name: (avg_pos_errs, avg_rot_errs, avg_linvel_errs, avg_angvel_errs)}.
+    When profiling is on (--profile or ELMO_PROFILE), the stage timings are saved to profile_path
+    (default: <result_path>/profile.json) and summarized after the report.
+    With a metric store only the files missing from it or changed since are evaluated
+    (all of them with recompute), and the CSVs and averages are built from the stored rows.
+    With check_precision and a float32 config, every file is also evaluated in float64 and
+    the deviations of the results are reported (precision_report).
+    """
+    os.makedirs(config['result_path'], exist_ok=True)
+    gt_paths, tag_paths = find_files(config)
+    tags = get_tags(config)
+    jobs = [(config, gt_paths[i], {tag: tag_paths[tag][i] for tag in tags}) for i in range(len(gt_paths))]
+    if config['store'] is None:
+        results = evaluate_groups(jobs, workers)
+    else:
+        with MetricStore(config['store']) as store:
+            with profiler.stage('store'):
+                keys = [store.group_key(*job) for job in jobs]
+                results = [None if recompute else store.get_group(config, job[1], key) for job, key in zip(jobs, keys)]
+            pending = [i for i, result in enumerate(results) if result is None]
+            for i, result in zip(pending, evaluate_groups([jobs[i] for i in pending], workers)):
+                results[i] = result
+                store.put_group(config, jobs[i][1], keys[i], result)
+        print(f'Evaluated {len(pending)} of {len(jobs)} files, {len(jobs) - len(pending)} read from {config["store"]}')
+
+    file_names, joint_names, lengths = [], [], []
+    errs = {variant['name']: ([], [], [], []) for variant in config['variants']}
+    extra_errs = {variant['name']: {metric: [] for metric in config['metrics']} for variant in config['variants']}
+    for file_name, joint_names, metrics, extra in results:
+        file_names.append(file_name)
+        lengths.append(metrics[config['variants'][0]['name']][-1])
+        for name, variant_metrics in metrics.items():
+            for k in range(4):
+                errs[name][k].append(np.multiply(variant_metrics[8 + k], variant_metrics[-1]))
+            for metric in config['metrics']:
+                extra_errs[name][metric].append(np.multiply(extra[name][metric], variant_metrics[-1]))
+
+    averages, extra_averages = {}, {}
+    for variant in config['variants']:
+        name = variant['name']
+        with profiler.stage('csv_write', variant=name):
+            averages[name] = calculate_average_error(lengths, *errs[name], joint_names, file_names, config['result_path'], name)
+            extra_averages[name] = {metric: calculate_metric_average(lengths, extra_errs[name][metric], joint_names, file_names,
+                                                                     config['result_path'], name, metric)
+                                    for metric in config['metrics']}
+
+    for variant in config['variants']:
+        avg_pos_errs, avg_rot_errs, avg_linvel_errs, avg_angvel_errs = averages[variant['name']]
+        print(config['rule'] + variant.get('title', variant['name']) + config['rule'])
+        print("joint p: %f, joint r: %f, joint lv: %f, joint av: %f" % (np.mean(avg_pos_errs[1:]), np.mean(avg_rot_errs[1:]), np.mean(avg_linvel_errs[1:]), np.mean(avg_angvel_errs[1:])))
+        if config['print_pelvis']:
+            print("pelv p: %f, pelv r: %f, pelv lv: %f, pelv av: %f" % (avg_pos_errs[0], avg_rot_errs[0], avg_linvel_errs[0], avg_angvel_errs[0]))
+        if config['metrics']:
+            avg_extra = extra_averages[variant['name']]
+            print(', '.join("joint %s: %f" % (metric, np.mean(avg_extra[metric][1:])) for metric in config['metrics']))
+            if config['print_pelvis']:
+                print(', '.join("pelv %s: %f" % (metric, avg_extra[metric][0]) for metric in config['metrics']))
+
+    if check_precision and np.dtype(config['dtype']) != np.float64:
+        reference_jobs = [(dict(config, dtype='float64'),) + job[1:] for job in jobs]
+        with profiler.stage('precision_check'):
+            precision_report(config, results, evaluate_groups(reference_jobs, workers))
+
+    if profiler.enabled:
+        profiler.report(profile_path or os.path.join(config['result_path'], 'profile.json'))
+
+    return averages
+
+def add_common_args(parser):
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes evaluating files in parallel')
+    parser.add_argument('--recompute', action='store_true', help='Evaluate every file again instead of reusing the metric store')
+    parser.add_argument('--profile', action='store_true', help='Record per-stage timings (same as ELMO_PROFILE=1)')
+    parser.add_argument('--profile-memory', action='store_true', help='Also trace memory allocations per stage (slower)')
+    parser.add_argument('--profile-out', type=str, default=None, help='Where to save the profile (JSON)')
+    parser.add_argument('--dtype', type=str, default=None, choices=['float32', 'float64'], help='Overrides the dtype of the config')
+    parser.add_argument('--check-precision', action='store_true', help='Report the deviation of float32 results from float64 on every file')
+    parser.add_argument('--metrics', type=str, nargs='*', default=None,
+                        help='Extra metrics of the core.metrics registry (geodesic, pa_mpjpe, jerk, foot_skate), overrides the config')
+
+def run_from_args(config, args):
+    if args.profile or args.profile_memory:
+        profiler.enable(trace_memory=args.profile_memory)
+        # seen by spawned worker processes
+        os.environ['ELMO_PROFILE'] = 'memory' if args.profile_memory else '1'
+    if args.dtype:
+        config['dtype'] = args.dtype
+    if args.metrics is not None:
+        config['metrics'] = args.metrics
+    return run_evaluation(config, workers=args.workers, profile_path=args.profile_out, recompute=args.recompute,
+                          check_precision=args.check_precision)
+
+def preset_main(config_name, description):
+    """
+    Entry point of the evaluate_*.py presets: run configs/<config_name>.json.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    add_common_args(parser)
+    args = parser.parse_args()
+    config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs')
+    run_from_args(load_config(os.path.join(config_dir, config_name + '.json')), args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate model outputs against GT as described by a config file.')
+    parser.add_argument('config', type=str, help='Path to the evaluation config (JSON)')
+    add_common_args(parser)
+    args = parser.parse_args()
+    run_from_args(load_config(args.config), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+import time
+import argparse
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+import core.animation as anim
+from core.animation import joint_levels, forward_kinematics, quat_rotate
+from core.utils import get_angle, get_positions, get_rotation_basis, match_length, inference_err, summarize_err
+
+# name -> (fn(context, *needs), needs): values shared by the metrics of a chunk, each computed once per chunk.
+# Every value is an (output, target) pair over the frames of the chunk.
+INTERMEDIATES = {}
+# name -> Metric
+METRICS = {}
+# the four metrics of inference_err
+BASE_METRICS = ('pos', 'rot', 'linvel', 'angvel')
+DEFAULT_PARAMS = {
+    # a foot joint is in contact while its GT speed is below this (units per frame)
+    'contact_speed': 0.005,
+    # names of the foot joints, skeleton specific: foot_skate needs them set
+    'foot_joints': None,
+}
+
+
+def register_intermediate(name, needs=()):
+    def wrap(fn):
+        INTERMEDIATES[name] = (fn, tuple(needs))
+        return fn
+    return wrap
+
+
+class Metric:
+    """
+    A per-joint error. fn(*needs) maps the intermediates of a chunk of n frames to (n - order, J)
+    values, the last row belonging to the last frame; order is the number of previous frames a value
+    needs (1 for velocities). Averages are over length - order values.
+    """
+    def __init__(self, name, fn, needs, order=0):
+        self.name = name
+        self.fn = fn
+        self.needs = tuple(needs)
+        self.order = order
+
+
+def register_metric(name, needs, order=0):
+    def wrap(fn):
+        METRICS[name] = Metric(name, fn, needs, order)
+        return fn
+    return wrap
+
+
+class ChunkContext:
+    """
+    The frames of output and target one chunk covers, with memoized intermediates.
+    """
+    def __init__(self, output, target, frames, dtype, params):
+        self.output = output
+        self.target = target
+        self.frames = frames
+        self.dtype = dtype
+        self.params = params
+        self.values = {}
+
+    def get(self, name):
+        if name not in self.values:
+            fn, needs = INTERMEDIATES[name]
+            self.values[name] = fn(self, *(self.get(need) for need in needs))
+        return self.values[name]
+
+    def pair(self, fn):
+        return fn(self.output, self.frames, self.dtype), fn(self.target, self.frames, self.dtype)
+
+
+def rotation_matrices(anim, frames=slice(None), dtype=np.float64):
+    if anim.is_compact:
+        q = anim.local_q[frames]
+        return R.from_quat(q.reshape(-1, 4)).as_matrix().reshape(q.shape[:-1] + (3, 3)).astype(dtype, copy=False)
+    return anim.local_t[frames, :, :3, :3].astype(dtype, copy=False)
+
+
+def global_positions(anim, frames=slice(None), dtype=np.float64):
+    """
+    World joint positions including the root motion (T, J, 3), from the local root transform and
+    the fix_root world positions (computed by world_positions without world transforms).
+    """
+    if anim.is_compact:
+        pos = anim.world_positions(frames=frames) if anim.world_p is None else anim.world_p[frames]
+        root_q, root_p = anim.local_q[frames, :1].astype(dtype), anim.local_p[frames, :1].astype(dtype)
+        return quat_rotate(root_q, pos.astype(dtype)) + root_p
+    root = anim.local_t[frames, :1].astype(dtype, copy=False)
+    pos = anim.world_positions(frames=frames) if anim.world_t is None else anim.world_t[frames, :, :3, 3]
+    pos = pos.astype(dtype, copy=False)
+    return (root[..., :3, :3] @ pos[..., None])[..., 0] + root[..., :3, 3]
+
+
+def procrustes_align(pred, gt):
+    """
+    pred (T, J, 3) moved onto gt by the rotation, uniform scale and translation of every frame that
+    minimize the squared joint distances (Umeyama), all frames in one batched SVD.
+    """
+    pred_mean, gt_mean = pred.mean(axis=1, keepdims=True), gt.mean(axis=1, keepdims=True)
+    x, y = pred - pred_mean, gt - gt_mean
+    u, s, vt = np.linalg.svd(np.swapaxes(x, -1, -2) @ y)
+    # no reflections
+    sign = np.sign(np.linalg.det(u @ vt))
+    u[..., 2] *= sign[:, None]
+    s[..., 2] *= sign
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = s.sum(axis=-1) / np.sum(x * x, axis=(1, 2))
+    return scale[:, None, None] * (x @ (u @ vt)) + gt_mean
+
+
+@register_intermediate('positions')
+def _positions(context):
+    return context.pair(get_positions)
+
+@register_intermediate('linvel', needs=('positions',))
+def _linvel(context, positions):
+    return tuple(pos[1:] - pos[:-1] for pos in positions)
+
+@register_intermediate('basis')
+def _basis(context):
+    return context.pair(get_rotation_basis)
+
+@register_intermediate('rotations')
+def _rotations(context):
+    return context.pair(rotation_matrices)
+
+@register_intermediate('global_positions')
+def _global_positions(context):
+    return context.pair(global_positions)
+
+@register_intermediate('global_velocity', needs=('global_positions',))
+def _global_velocity(context, positions):
+    return tuple(pos[1:] - pos[:-1] for pos in positions)
+
+@register_intermediate('foot_contact', needs=('global_velocity',))
+def _foot_contact(context, velocity):
+    if not context.params['foot_joints']:
+        raise ValueError('foot_skate needs the names of the foot joints, set the foot_joints metric parameter '
+                         '(config key metric_params), e.g. {"foot_joints": ["LeftFoot", "LeftToe", "RightFoot", "RightToe"]}')
+    missing = [name for name in context.params['foot_joints'] if name not in context.target.joints]
+    if missing:
+        raise ValueError('Foot joints %s are not in the skeleton, set the foot_joints metric parameter (config key metric_params)' % missing)
+    feet = np.isin(context.target.joints, context.params['foot_joints'])
+    return feet & (np.linalg.norm(velocity[1], axis=-1) < context.params['contact_speed'])
+
+
+@register_metric('pos', needs=('positions',))
+def pos_err(positions):
+    # pelvis position from the local root transform, other joints root-relative
+    return np.linalg.norm(positions[0] - positions[1], axis=-1)
+
+@register_metric('rot', needs=('basis',))
+def rot_err(basis):
+    (x_basis, y_basis, _, _), (gt_x_basis, gt_y_basis, _, _) = basis
+    return (get_angle(gt_x_basis, x_basis) + get_angle(gt_y_basis, y_basis)) / 2
+
+@register_metric('linvel', needs=('linvel',), order=1)
+def linvel_err(linvel):
+    return np.linalg.norm(linvel[0] - linvel[1], axis=-1)
+
+@register_metric('angvel', needs=('basis',), order=1)
+def angvel_err(basis):
+    (_, _, x_basis, y_basis), (_, _, gt_x_basis, gt_y_basis) = basis
+    return (get_angle(gt_x_basis, x_basis) + get_angle(gt_y_basis, y_basis)) / 2
+
+@register_metric('geodesic', needs=('rotations',))
+def geodesic_err(rotations):
+    # angle of gt^T @ output from its trace, trace(a^T b) = sum(a * b)
+    cos = (np.sum(rotations[0] * rotations[1], axis=(-1, -2)) - 1) / 2
+    return np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+
+@register_metric('pa_mpjpe', needs=('global_positions',))
+def pa_mpjpe_err(positions):
+    return np.linalg.norm(procrustes_align(*positions) - positions[1], axis=-1)
+
+@register_metric('jerk', needs=('global_positions',), order=3)
+def jerk_err(positions):
+    # third finite difference of the output positions, its jitter whatever the GT
+    pos = positions[0]
+    return np.linalg.norm(pos[3:] - 3 * pos[2:-1] + 3 * pos[1:-2] - pos[:-3], axis=-1)
+
+@register_metric('foot_skate', needs=('global_velocity', 'foot_contact'), order=1)
+def foot_skate_err(velocity, contact):
+    # horizontal output foot motion while the GT foot is in contact, 0 for the other joints
+    return np.where(contact, np.linalg.norm(velocity[0][..., [0, 2]], axis=-1), 0)
+
+
+class MetricEngine:
+    """
+    Registered metrics of output against target (animations with world transforms, fix_root=True)
+    in a single pass: every chunk of chunk_size frames (the whole sequence by default) computes the
+    intermediates the metrics need once, plus the previous frames the highest order needs.
+
+        engine = MetricEngine(['pos', 'rot', 'geodesic', 'jerk'])
+        per_joint, length = engine.evaluate(output, gt)   # {name: (J,) average}
+    """
+    def __init__(self, metrics=BASE_METRICS, chunk_size=None, dtype=None, **params):
+        unknown = [name for name in metrics if name not in METRICS]
+        if unknown:
+            raise ValueError('Unknown metrics %s, registered: %s' % (unknown, list(METRICS)))
+        self.metrics = [METRICS[name] for name in metrics]
+        self.history = max((metric.order for metric in self.metrics), default=0)
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.params = dict(DEFAULT_PARAMS, **params)
+
+    def sums(self, output, target):
+        """
+        Per-joint sums {name: (J,)} and number of values {name: length - order}.
+        """
+        length = output.length
+        chunk_size = self.chunk_size or max(length, 1)
+        dtype = np.result_type(output.dtype, target.dtype) if self.dtype is None else self.dtype
+        sums = {metric.name: np.zeros(output.joints.shape[0]) for metric in self.metrics}
+        for start in range(0, length, chunk_size):
+            stop = min(start + chunk_size, length)
+            context = ChunkContext(output, target, slice(max(start - self.history, 0), stop), dtype, self.params)
+            for metric in self.metrics:
+                values = metric.fn(*(context.get(need) for need in metric.needs))
+                # rows of the frames of this chunk, the others only fed the differences
+                sums[metric.name] += np.sum(values[max(len(values) - (stop - start), 0):], axis=0)
+        counts = {metric.name: max(length - metric.order, 0) for metric in self.metrics}
+        return sums, counts
+
+    def evaluate(self, output, target):
+        """
+        Per-joint averages {name: (J,)} and the number of frames.
+        """
+        sums, counts = self.sums(output, target)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {name: sums[name] / counts[name] for name in sums}, output.length
+
+
+def as_slice(idx):
+    """
+    Index array idx as a slice when it is a contiguous range or a single repeated index
+    (broadcast against the others), else idx.
+    """
+    if np.all(idx == idx[0]):
+        return slice(idx[0], idx[0] + 1)
+    if np.all(np.diff(idx) == 1):
+        return slice(idx[0], idx[-1] + 1)
+    return idx
+
+
+def vector_norm(v):
+    # np.linalg.norm(v, axis=-1, keepdims=True) without its dispatch overhead, same values
+    return np.sqrt(np.add.reduce(v * v, axis=-1, keepdims=True))
+
+
+def frame_angle(v1, v2):
+    # get_angle with fewer numpy calls, same values
+    v1 = v1 / vector_norm(v1)
+    v2 = v2 / vector_norm(v2)
+    return np.arccos(np.minimum(np.maximum(np.add.reduce(v1 * v2, axis=-1), -1.0), 1.0)) * 180 / np.pi
+
+
+class StreamingErr:
+    """
+    inference_err computed incrementally, for motion arriving one or a few frames at a time
+    (e.g. live model output at 60 Hz). Only the per-joint error sums and the last frame
+    (for the velocity terms) are kept, so the state is O(J) whatever the number of frames.
+
+        errs = StreamingErr(parents)
+        for local_t, gt_local_t in frames:
+            errs.update(local_t, gt_local_t)
+        errs.result()  # same tuple as inference_err
+
+    After a whole sequence the result equals inference_err up to float summation order.
+    Single-frame updates take a fast path on preallocated buffers, with the same results.
+    """
+    def __init__(self, parents, dtype=np.float64):
+        self.parents = np.asarray(parents)
+        # the errors are computed in dtype, the sums kept in float64 (see inference_err)
+        self.dtype = np.dtype(dtype)
+        self.levels = joint_levels(self.parents)
+        # (joints, their parents) of every FK level, as slices when contiguous (views instead of copies)
+        self.fk_levels = [(as_slice(idx), as_slice(self.parents[idx].astype(np.intp))) for idx in self.levels]
+        self.reset()
+
+    def reset(self):
+        num_joints = len(self.parents)
+        self.length = 0
+        self.pos_err_sum = np.zeros(num_joints)
+        self.rot_err_sum = np.zeros(num_joints)
+        self.linvel_err_sum = np.zeros(num_joints)
+        self.angvel_err_sum = np.zeros(num_joints)
+        self._last = None
+        # single-frame buffers, output and GT on the second axis. The local transforms and positions
+        # have two slots used in turn, so the previous frame stays in the other one
+        self._local = np.zeros((2, 2, num_joints, 4, 4), dtype=self.dtype)
+        self._pos = np.zeros((2, 2, 1, num_joints, 3), dtype=self.dtype)
+        self._world = np.zeros((2, num_joints, 4, 4), dtype=self.dtype)
+        self._world[:, 0] = np.eye(4)
+        # x and y basis vectors (rotation/frame-to-frame rotation, output/GT, J, x/y, 3)
+        self._basis = np.zeros((2, 2, num_joints, 2, 3), dtype=self.dtype)
+        self._slot = 0
+
+    def update(self, local_t, gt_local_t, world_t=None, gt_world_t=None):
+        """
+        Add frames given as local transforms (J, 4, 4) or (n, J, 4, 4) of the output and the GT.
+        World transforms (fix_root=True) are computed unless given.
+        """
+        if np.shape(local_t)[:-3] in ((), (1,)) and np.shape(gt_local_t)[:-3] in ((), (1,)):
+            # one frame, (J, 4, 4) or (1, J, 4, 4)
+            single = [None if x is None else np.reshape(x, np.shape(x)[-3:]) for x in (local_t, gt_local_t, world_t, gt_world_t)]
+            self._update_frame(*single)
+            return
+        # output and GT stacked on a leading axis, so every step below is one numpy call for both
+        local_t = np.stack(np.broadcast_arrays(local_t, gt_local_t)).astype(self.dtype, copy=False)
+        if local_t.ndim == 4:
+            local_t = local_t[:, None]
+        if world_t is None or gt_world_t is None:
+            world_t = forward_kinematics(local_t, self.parents, fix_root=True, levels=self.levels)
+        else:
+            world_t = np.stack((world_t, gt_world_t)).reshape(local_t.shape).astype(self.dtype, copy=False)
+        # pelvis position from the local root transform, other joints from FK with a fixed root
+        pos = np.concatenate((local_t[:, :, :1, :3, 3], world_t[:, :, 1:, :3, 3]), axis=2)
+        rot = local_t[..., :3, :3]
+        self.length += pos.shape[1]
+
+        self.pos_err_sum += np.sum(np.linalg.norm(pos[0] - pos[1], axis=-1), axis=0)
+
+        last = (pos[:, -1:], rot[:, -1:])
+        if self._last is not None:
+            pos = np.concatenate((self._last[0], pos), axis=1)
+            rot = np.concatenate((self._last[1], rot), axis=1)
+        new = slice(1, None) if self._last is not None else slice(None)
+        self._last = last
+
+        linvel = pos[:, 1:] - pos[:, :-1]
+        self.linvel_err_sum += np.sum(np.linalg.norm(linvel[0] - linvel[1], axis=-1), axis=0)
+
+        # x and y basis vectors of the rotations of the new frames and of the frame-to-frame rotations
+        angvel = rot[:, 1:] @ np.swapaxes(rot[:, :-1], -1, -2)
+        num_rot = rot[:, new].shape[1]
+        basis = np.swapaxes(np.concatenate((rot[:, new], angvel), axis=1)[..., :2], -1, -2)
+        err = get_angle(basis[1], basis[0])
+        err = (err[..., 0] + err[..., 1]) / 2
+        self.rot_err_sum += np.sum(err[:num_rot], axis=0)
+        self.angvel_err_sum += np.sum(err[num_rot:], axis=0)
+
+    def _update_frame(self, local_t, gt_local_t, world_t, gt_world_t):
+        # update with a single (J, 4, 4) frame: the steps of update on preallocated buffers,
+        # without stacking or concatenating, same values
+        self._slot = 1 - self._slot
+        local, pos = self._local[self._slot], self._pos[self._slot]
+        local[0], local[1] = local_t, gt_local_t
+        rot = local[:, None, :, :3, :3]
+        pos[:, 0, 0] = local[:, 0, :3, 3]
+        if world_t is None or gt_world_t is None:
+            world = self._world
+            for idx, parent in self.fk_levels:
+                world[:, idx] = world[:, parent] @ local[:, idx]
+            pos[:, 0, 1:] = world[:, 1:, :3, 3]
+        else:
+            pos[0, 0, 1:], pos[1, 0, 1:] = world_t[1:, :3, 3], gt_world_t[1:, :3, 3]
+        self.length += 1
+        self.pos_err_sum += vector_norm(pos[0, 0] - pos[1, 0])[..., 0]
+
+        basis = self._basis
+        basis[0] = np.swapaxes(rot[:, 0, ..., :2], -1, -2)
+        num_basis = 1
+        if self._last is not None:
+            last_pos, last_rot = self._last
+            linvel = pos[:, 0] - last_pos[:, 0]
+            self.linvel_err_sum += vector_norm(linvel[0] - linvel[1])[..., 0]
+            # x and y columns of rot @ last_rot^T are the first two rows of last_rot @ rot^T
+            np.matmul(last_rot[:, 0, ..., :2, :], np.swapaxes(rot[:, 0], -1, -2), out=basis[1])
+            num_basis = 2
+        self._last = (pos, rot)
+
+        err = frame_angle(basis[:num_basis, 1], basis[:num_basis, 0])
+        err = (err[..., 0] + err[..., 1]) / 2
+        self.rot_err_sum += err[0]
+        if num_basis == 2:
+            self.angvel_err_sum += err[1]
+
+    def result(self):
+        """
+        Current averages, the inference_err tuple. Velocity errors are nan before the second frame.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return summarize_err(self.pos_err_sum, self.rot_err_sum, self.linvel_err_sum, self.angvel_err_sum, self.length)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded output/GT pair through StreamingErr and compare with inference_err.')
+    parser.add_argument('output', type=str, help='Model output BVH')
+    parser.add_argument('target', type=str, help='GT BVH')
+    parser.add_argument('--frames-per-update', type=int, default=1)
+    parser.add_argument('--blender', action='store_true')
+    args = parser.parse_args()
+
+    output, target = anim.Animation(), anim.Animation()
+    output.load_bvh(args.output, blender=args.blender)
+    target.load_bvh(args.target, blender=args.blender)
+    match_length([output, target])
+
+    errs = StreamingErr(target.parents)
+    step = args.frames_per_update
+    start = time.perf_counter()
+    for k in range(0, output.length, step):
+        errs.update(output.local_t[k:k + step], target.local_t[k:k + step])
+    elapsed = time.perf_counter() - start
+    streamed = errs.result()
+
+    output.compute_world_transform(fix_root=True)
+    target.compute_world_transform(fix_root=True)
+    batch = inference_err(output, target)
+    diff = max(np.max(np.abs(np.asarray(a, dtype=np.float64) - b)) for a, b in zip(streamed, batch))
+    print("joint p: %f, joint r: %f, joint lv: %f, joint av: %f" % streamed[4:8])
+    print("pelv p: %f, pelv r: %f, pelv lv: %f, pelv av: %f" % streamed[:4])
+    print(f'{elapsed / output.length * 1e6:.1f} us per frame, max difference to inference_err {diff:.3g}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import argparse
+import threading
+from collections import OrderedDict
+import numpy as np
+import h5py
+
+
+def empty_frame():
+    # stand-in for frames whose group has no pointcloud dataset
+    return np.zeros((0, 3), dtype=np.float32)
+
+
+class PointCloudFrames:
+    """
+    Lazy frame source over a LiDAR .h5 file (one frame-XXXXXX/pointcloud group per frame).
+    The file is opened once and frames are read on demand, frames[k] or frames.window(start, size).
+    A background thread prefetches the `prefetch` frames following the last one asked for,
+    and at most `max_cached` frames are kept in memory.
+    """
+    def __init__(self, path, prefetch=30, max_cached=None):
+        self.path = path
+        self.file = h5py.File(path, 'r')
+        self.length = len(self.file.keys())
+        self.prefetch = prefetch
+        self.max_cached = max(max_cached or 2 * prefetch, prefetch + 1)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._next = 0
+        self._closed = False
+        self._thread = None
+        if prefetch > 0:
+            self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_frame(self, idx):
+        """
+        Read one frame from the file, bypassing the buffer.
+        """
+        group_name = f"frame-{idx:06}"
+        if group_name not in self.file:
+            raise ValueError('No pcd data on %s' % group_name)
+        group = self.file[group_name]
+        if 'pointcloud' not in group:
+            return empty_frame()
+        return np.asarray(group['pointcloud'][()], dtype=np.float32)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError(f'frame {idx} out of range for {self.length} frames')
+
+        with self._lock:
+            frame = self._cache.get(idx)
+            if frame is not None:
+                self._cache.move_to_end(idx)
+        if frame is None:
+            frame = self.read_frame(idx)
+            self._store(idx, frame)
+
+        # ask the prefetch thread for what comes next
+        self._next = idx + 1
+        self._wake.set()
+        return frame
+
+    def window(self, start, size):
+        return [self[i] for i in range(start, min(start + size, self.length))]
+
+    def __iter__(self):
+        for idx in range(self.length):
+            yield self[idx]
+
+    def _store(self, idx, frame):
+        with self._lock:
+            self._cache[idx] = frame
+            self._cache.move_to_end(idx)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def _prefetch_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            start = self._next
+            for idx in range(start, min(start + self.prefetch, self.length)):
+                # stop early when closed or when the reader jumped somewhere else
+                if self._closed or self._next != start:
+                    break
+                with self._lock:
+                    cached = idx in self._cache
+                if not cached:
+                    try:
+                        self._store(idx, self.read_frame(idx))
+                    except ValueError:
+                        # surfaces in the reader when it gets to this frame
+                        break
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.file.close()
+
+
+class PackedPointCloud:
+    """
+    Reader of the packed layout written by pack_point_cloud: all points of a take in one
+    (N_total, C) dataset, frame k being points[frame_offsets[k]:frame_offsets[k + 1]],
+    and a per-frame missing mask. Any frame or frame range is a single slice read.
+    Same interface as PointCloudFrames.
+    """
+    iter_chunk = 256
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.file = h5py.File(path, 'r')
+        self.points = self.file['points']
+        self.frame_offsets = self.file['frame_offsets'][()]
+        self.missing = self.file['missing'][()]
+        self.length = len(self.missing)
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_frame(self, idx):
+        return self.points[self.frame_offsets[idx]:self.frame_offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError(f'frame {idx} out of range for {self.length} frames')
+        if self.missing[idx]:
+            return empty_frame()
+        return self.read_frame(idx)
+
+    def read_range(self, start, stop):
+        """
+        Frames [start, stop) with one read, returned as a list of per-frame views.
+        """
+        stop = min(stop, self.length)
+        offsets = self.frame_offsets[start:stop + 1]
+        block = self.points[offsets[0]:offsets[-1]]
+        frames = np.split(block, offsets[1:-1] - offsets[0])
+        return [empty_frame() if self.missing[start + i] else frame for i, frame in enumerate(frames)]
+
+    def window(self, start, size):
+        return self.read_range(start, start + size)
+
+    def __iter__(self):
+        # read ahead in blocks of frames, one slice per block
+        for start in range(0, self.length, self.iter_chunk):
+            yield from self.read_range(start, start + self.iter_chunk)
+
+    def close(self):
+        self.file.close()
+
+
+def is_packed(path):
+    with h5py.File(path, 'r') as f:
+        return 'frame_offsets' in f
+
+
+def open_point_cloud(path, **kwargs):
+    """
+    Frame source for a LiDAR .h5 in either layout (per-frame groups or packed).
+    """
+    if is_packed(path):
+        return PackedPointCloud(path, **kwargs)
+    return PointCloudFrames(path, **kwargs)
+
+
+def pack_point_cloud(src, dst, compression=None, chunk_rows=65536):
+    """
+    Convert a per-frame-group .h5 into the packed layout. Frames are streamed, so memory
+    stays bounded by chunk_rows points. compression is passed to h5py ('gzip', 'lzf' or None).
+    Returns the number of frames and the number of missing frames.
+    """
+    frames = PointCloudFrames(src, prefetch=0)
+    num_channels = next((frame.shape[1] for frame in frames if len(frame)), 3)
+    offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    missing = np.zeros(len(frames), dtype=bool)
+
+    with h5py.File(dst, 'w') as out:
+        points = out.create_dataset('points', shape=(0, num_channels), maxshape=(None, num_channels), dtype=np.float32,
+                                    chunks=(min(chunk_rows, 16384), num_channels), compression=compression)
+        buffer, buffered = [], 0
+        def flush():
+            block = np.concatenate(buffer) if buffer else np.zeros((0, num_channels), dtype=np.float32)
+            n = points.shape[0]
+            points.resize(n + len(block), axis=0)
+            points[n:] = block
+
+        for idx in range(len(frames)):
+            frame = frames.read_frame(idx)
+            missing[idx] = 'pointcloud' not in frames.file[f"frame-{idx:06}"]
+            if len(frame):
+                buffer.append(frame[:, :num_channels])
+                buffered += len(frame)
+            offsets[idx + 1] = offsets[idx] + len(frame)
+            if buffered >= chunk_rows:
+                flush()
+                buffer, buffered = [], 0
+        flush()
+
+        out.create_dataset('frame_offsets', data=offsets)
+        out.create_dataset('missing', data=missing)
+        out.attrs['layout'] = 'packed'
+    frames.close()
+    return len(missing), int(missing.sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert LiDAR .h5 files to the packed point cloud layout.')
+    parser.add_argument('paths', nargs='+', help='.h5 files or directories')
+    parser.add_argument('--suffix', type=str, default='_packed', help='Suffix of the output files')
+    parser.add_argument('--inplace', action='store_true', help='Replace the source files')
+    parser.add_argument('--compression', type=str, default=None, choices=['gzip', 'lzf'])
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                paths += [os.path.join(root, file) for file in files if file.endswith('.h5')]
+        else:
+            paths.append(path)
+
+    for path in sorted(paths):
+        if is_packed(path):
+            continue
+        stem, ext = os.path.splitext(path)
+        dst = stem + '.tmp' + ext if args.inplace else stem + args.suffix + ext
+        num_frames, num_missing = pack_point_cloud(path, dst, compression=args.compression)
+        if args.inplace:
+            os.replace(dst, path)
+            dst = path
+        print(f'Packed {num_frames} frames ({num_missing} missing) from {path} to {dst}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import argparse
+import numpy as np
+import core.animation as anim
+from core.pointcloud import open_point_cloud
+from core.alignment import Alignment
+
+
+def ragged(frames):
+    """
+    Concatenated points (N_total, 3) and frame offsets (T + 1,) of a list of (n_k, C) frames.
+    """
+    counts = np.array([len(frame) for frame in frames], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    points = [np.asarray(frame, dtype=np.float32)[:, :3] for frame in frames if len(frame)]
+    points = np.concatenate(points) if points else np.zeros((0, 3), dtype=np.float32)
+    return points, offsets
+
+
+def frame_ids(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def voxel_downsample(points, offsets, voxel_size):
+    """
+    Replace the points of every frame falling in the same voxel by their centroid, all frames at once.
+    Returns the new points and offsets, frames keep their order.
+    """
+    if len(points) == 0:
+        return points, offsets
+    cells = np.floor(points / voxel_size).astype(np.int64)
+    keys = np.concatenate((frame_ids(offsets)[:, None], cells), axis=1)
+    # unique rows are sorted by frame first, so the output stays grouped by frame
+    keys, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    centroids = np.zeros((len(keys), 3))
+    np.add.at(centroids, inverse, points)
+    centroids /= counts[:, None]
+    new_counts = np.bincount(keys[:, 0], minlength=len(offsets) - 1)
+    return centroids.astype(np.float32), np.concatenate(([0], np.cumsum(new_counts)))
+
+
+def random_sample(points, offsets, num_points, rng):
+    """
+    Indices (T, num_points) of a random subset of every frame. Frames with fewer points repeat
+    a random permutation of their points, empty frames get -1.
+    """
+    counts = np.diff(offsets)
+    # a random permutation inside every frame: sort by (frame, random key)
+    order = np.lexsort((rng.random(len(points)), frame_ids(offsets)))
+    slots = np.arange(num_points)[None] % np.maximum(counts, 1)[:, None]
+    idx = order[np.minimum(offsets[:-1, None] + slots, max(len(points) - 1, 0))] if len(points) else np.zeros(slots.shape, dtype=np.int64)
+    idx[counts == 0] = -1
+    return idx
+
+
+def farthest_point_sample(points, offsets, num_points, rng):
+    """
+    Indices (T, num_points) of a farthest point sampling of every frame, all frames advancing together
+    on a padded (T, n_max, 3) array. The first point of every frame is drawn from rng.
+    Frames with fewer points repeat points once all are picked, empty frames get -1.
+    """
+    counts = np.diff(offsets)
+    num_frames = len(counts)
+    n_max = max(counts.max(initial=0), 1)
+    valid = np.arange(n_max)[None] < counts[:, None]
+    padded = np.zeros((num_frames, n_max, 3), dtype=np.float32)
+    padded[valid] = points
+
+    rows = np.arange(num_frames)
+    idx = np.zeros((num_frames, num_points), dtype=np.int64)
+    idx[:, 0] = np.floor(rng.random(num_frames) * np.maximum(counts, 1)).astype(np.int64)
+    # padding stays at -1, below any real distance
+    dist = np.where(valid, np.inf, -1).astype(np.float32)
+    # one contiguous (T, n_max) array per coordinate and in-place updates, the loop runs num_points times
+    coords = np.ascontiguousarray(padded.transpose(2, 0, 1))
+    d, buf = np.empty_like(dist), np.empty_like(dist)
+    for k in range(1, num_points):
+        last = padded[rows, idx[:, k - 1]]
+        np.subtract(coords[0], last[:, 0, None], out=d)
+        np.multiply(d, d, out=d)
+        for c in (1, 2):
+            np.subtract(coords[c], last[:, c, None], out=buf)
+            np.multiply(buf, buf, out=buf)
+            d += buf
+        np.minimum(dist, d, out=dist)
+        idx[:, k] = np.argmax(dist, axis=1)
+    idx += offsets[:-1, None]
+    idx[counts == 0] = -1
+    return idx
+
+
+def pelvis_positions(bvh_path, num_frames, lidar_offset=0.0):
+    """
+    Root positions of the BVH at the num_frames LiDAR frames (num_frames, 3), the LiDAR recording
+    starting lidar_offset seconds after the mocap.
+    """
+    motion = anim.Animation()
+    motion.load_bvh(bvh_path)
+    alignment = Alignment.of(motion, num_frames, lidar_offset=lidar_offset)
+    if not alignment.covered.all():
+        raise ValueError(f'{bvh_path} covers {alignment.covered.sum()} LiDAR frames, the point clouds {num_frames}')
+    return alignment.resample(motion).local_t[:, 0, :3, 3]
+
+
+def process_frames(frames, num_points, sampling='fps', voxel_size=None, center=None, rng=None):
+    """
+    (T, num_points, 3) float32 and the number of points per frame after voxelization (0 for missing frames)
+    of a list of point cloud frames. center (T, 3) is subtracted from every frame.
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    points, offsets = ragged(frames)
+    if voxel_size:
+        points, offsets = voxel_downsample(points, offsets, voxel_size)
+    if sampling == 'fps':
+        idx = farthest_point_sample(points, offsets, num_points, rng)
+    elif sampling == 'random':
+        idx = random_sample(points, offsets, num_points, rng)
+    else:
+        raise ValueError('Unknown sampling %s' % sampling)
+
+    out = np.zeros(idx.shape + (3,), dtype=np.float32)
+    valid = idx >= 0
+    out[valid] = points[idx[valid]]
+    if center is not None:
+        out -= np.where(valid[..., None], np.asarray(center, dtype=np.float32)[:, None], 0)
+    return out, np.diff(offsets)
+
+
+def process_take(source, num_frames, num_points=1024, sampling='fps', voxel_size=None, center=None, rng=None,
+                 chunk_frames=256, out=None):
+    """
+    process_frames over the first num_frames frames of an open point cloud take, chunk_frames
+    at a time, into out (allocated when None). Returns out and the number of points per frame.
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    if out is None:
+        out = np.zeros((num_frames, num_points, 3), dtype=np.float32)
+    counts = np.zeros(num_frames, dtype=np.int64)
+    for start in range(0, num_frames, chunk_frames):
+        stop = min(start + chunk_frames, num_frames)
+        chunk_center = None if center is None else center[start:stop]
+        out[start:stop], counts[start:stop] = process_frames(source.window(start, stop - start), num_points,
+                                                              sampling, voxel_size, chunk_center, rng)
+    return out, counts
+
+
+def preprocess_take(h5_path, out_path, num_points=1024, sampling='fps', voxel_size=None, bvh_path=None,
+                    lidar_offset=0.0, seed=0, chunk_frames=256):
+    """
+    Preprocess all LiDAR frames of a take into out_path, a (T, num_points, 3) float32 .npy that
+    np.load(out_path, mmap_mode='r') maps without reading it, plus <out>_counts.npy with the
+    number of points per frame before sampling (0 for missing frames).
+    With bvh_path the points are made relative to the BVH root at the same instant, the LiDAR
+    recording starting lidar_offset seconds after the mocap.
+    Frames are processed chunk_frames at a time. The result is deterministic given seed and the
+    sampling parameters (num_points, sampling, voxel_size, bvh_path, lidar_offset), and does not
+    depend on chunk_frames: the random draws of all chunks follow one stream in frame order.
+    """
+    rng = np.random.default_rng(seed)
+    with open_point_cloud(h5_path, prefetch=0) as source:
+        num_frames = len(source)
+        center = pelvis_positions(bvh_path, num_frames, lidar_offset) if bvh_path else None
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(num_frames, num_points, 3))
+        _, counts = process_take(source, num_frames, num_points, sampling, voxel_size, center, rng, chunk_frames, out)
+        out.flush()
+        del out
+    np.save(os.path.splitext(out_path)[0] + '_counts.npy', counts)
+    return num_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Turn the LiDAR frames of a take into a fixed-size (T, N, 3) array.')
+    parser.add_argument('h5', type=str, help='LiDAR .h5 of the take')
+    parser.add_argument('--out', type=str, required=True, help='Output .npy')
+    parser.add_argument('--bvh', type=str, default=None, help='Mocap of the take, points are made relative to its root')
+    parser.add_argument('--num-points', type=int, default=1024)
+    parser.add_argument('--sampling', type=str, default='fps', choices=['fps', 'random'])
+    parser.add_argument('--voxel-size', type=float, default=None, help='Voxel grid downsampling before sampling')
+    parser.add_argument('--lidar-offset', type=float, default=0.0, help='Start of the LiDAR recording relative to the mocap, in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    num_frames = preprocess_take(args.h5, args.out, args.num_points, args.sampling, args.voxel_size, args.bvh,
+                                 args.lidar_offset, seed=args.seed)
+    print(f'Saved {num_frames} frames of {args.num_points} points to {args.out}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import resource
+import tracemalloc
+import contextlib
+from collections import defaultdict
+
+
+class Profiler:
+    """
+    Per-stage wall time, CPU time and memory records, e.g.
+
+        with profiler.stage('fk', file=path, variant='base'):
+            motion.compute_world_transform()
+
+    Inside `with profiler.scope(file=gt_path, variant='base')` every stage is recorded under that
+    file and variant, e.g. the parse of a model output under the GT file it is scored against,
+    so the per-file totals sum all the work done for a file.
+    Disabled profilers cost one attribute check per stage. With trace_memory the
+    tracemalloc peak of every stage is recorded too (slower, python allocations only).
+    rss_peak_mb is the process high-water mark when the stage ended.
+    """
+    def __init__(self, enabled=False, trace_memory=False):
+        self.enabled = False
+        self.trace_memory = False
+        self.records = []
+        self._stack = []
+        self._scope = None
+        if enabled:
+            self.enable(trace_memory)
+
+    def enable(self, trace_memory=False):
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def _stage(self, name, file, variant):
+        if self.trace_memory:
+            # keep the parent's peak before resetting it for this stage
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {'peak': 0}
+        self._stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': name,
+                'file': file,
+                'variant': variant,
+                'wall': time.perf_counter() - wall,
+                'cpu': time.process_time() - cpu,
+                'rss_peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+            self._stack.pop()
+            if self.trace_memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['traced_peak_mb'] = peak / 1024 / 1024
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            self.records.append(record)
+
+    def stage(self, name, file=None, variant=None):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        if self._scope is not None:
+            file, variant = self._scope
+        return self._stage(name, file, variant)
+
+    @contextlib.contextmanager
+    def scope(self, file=None, variant=None):
+        previous, self._scope = self._scope, (file, variant)
+        try:
+            yield
+        finally:
+            self._scope = previous
+
+    def summary(self, top=10):
+        stages = defaultdict(lambda: {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'rss_peak_mb': 0.0})
+        files = defaultdict(float)
+        for record in self.records:
+            stage = stages[record['stage']]
+            stage['count'] += 1
+            stage['wall'] += record['wall']
+            stage['cpu'] += record['cpu']
+            stage['rss_peak_mb'] = max(stage['rss_peak_mb'], record['rss_peak_mb'])
+            if 'traced_peak_mb' in record:
+                stage['traced_peak_mb'] = max(stage.get('traced_peak_mb', 0.0), record['traced_peak_mb'])
+            if record['file'] is not None:
+                files[record['file']] += record['wall']
+        slowest = sorted(files.items(), key=lambda x: x[1], reverse=True)[:top]
+        return {'stages': dict(stages), 'slowest_files': slowest}
+
+    def report(self, path=None, top=10):
+        """
+        Print the per-stage totals and the top slowest files, and save everything as JSON to path.
+        """
+        summary = self.summary(top)
+        print('------------------profile------------------')
+        for name, stage in sorted(summary['stages'].items(), key=lambda x: x[1]['wall'], reverse=True):
+            line = f"{name:16s} x{stage['count']:<5d} wall {stage['wall']:9.3f} s  cpu {stage['cpu']:9.3f} s  rss peak {stage['rss_peak_mb']:8.1f} MB"
+            if 'traced_peak_mb' in stage:
+                line += f"  traced peak {stage['traced_peak_mb']:8.1f} MB"
+            print(line)
+        print(f'slowest {len(summary["slowest_files"])} files:')
+        for file, wall in summary['slowest_files']:
+            print(f'{wall:9.3f} s  {file}')
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(dict(summary, records=self.records), f, indent=2)
+            print(f'Saved profile to {path}')
+        return summary
+
+
+# ELMO_PROFILE=1 enables timing, ELMO_PROFILE=memory also traces allocations
+_mode = os.environ.get('ELMO_PROFILE', '')
+profiler = Profiler(enabled=_mode not in ('', '0'), trace_memory=_mode == 'memory')
+
+
+def call_with_records(fn, *args):
+    """
+    Run fn(*args) and return its result with the profile records it produced,
+    used to bring records back from worker processes. Forked workers start with a copy of
+    the parent's records, so only those made during the call are returned.
+    """
+    start = len(profiler.records)
+    result = fn(*args)
+    records = profiler.records[start:]
+    del profiler.records[start:]
+    return result, records
@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+import matplotlib.colors as colors
+import matplotlib.patheffects as pe
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+from PIL import Image
+from core.pointcloud import open_point_cloud
+from core.alignment import Alignment
+
+SCALE = 30
+
+
+def display_positions(motion, alignment=None):
+    """
+    World joint positions (K, J, 3) in plot units at the K LiDAR frames of alignment
+    (default: 20 Hz frames spanning the motion), so frame k is shown with point cloud k.
+    """
+    alignment = Alignment.of(motion) if alignment is None else alignment
+    if np.array_equal(alignment.motion_pos, alignment.motion_index):
+        # every LiDAR frame is on a motion frame (60 / 20 Hz): only those frames are composed
+        return motion.world_positions(frames=alignment.motion_index, fix_root=False) * SCALE
+    return alignment.resample(motion).world_positions(fix_root=False) * SCALE
+
+
+class SkeletonScene:
+    """
+    The animation_plot scene on a figure: checkerboard floor, the skeleton as a single
+    Line3DCollection and the point cloud scatter, with update(i, xyz) moving them to frame i.
+    Point clouds are copied into a preallocated buffer of max_points (grown when needed),
+    the unused points stay at the origin. first_frame numbers the titles when positions is a part of a take.
+    """
+    def __init__(self, fig, positions, parents, with_points=True, max_points=1000, first_frame=0):
+        self.positions = positions
+        self.first_frame = first_frame
+        self.bones = np.array([[j, parents[j]] for j in range(len(parents)) if parents[j] != -1])
+        ax = self.ax = fig.add_subplot(111, projection='3d')
+        rscale = SCALE * 1.5
+        ax.set_xlim3d(-rscale, rscale)
+        ax.set_zlim3d(0, rscale*2)
+        ax.set_ylim3d(-rscale, rscale)
+
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.set_zlabel('Z')
+        ax.view_init(20, -60) # (-40, 60): up view
+        ax.set_proj_type('ortho')
+
+        # checkerboard pane
+        facec = (254, 254, 254)
+        linec = (240, 240, 240)
+        facec = list(np.array(facec) / 256.0) + [1.0]
+        linec = list(np.array(linec) / 256.0) + [1.0]
+
+        ax.zaxis.set_pane_color(facec)
+        ax.yaxis.set_pane_color((1.0, 1.0, 1.0, 0.0))
+        ax.xaxis.set_pane_color((1.0, 1.0, 1.0, 0.0))
+
+        ax.zaxis.line.set_lw(0.)
+        ax.yaxis.line.set_lw(0.)
+        ax.yaxis.line.set_color(linec)
+        ax.xaxis.line.set_lw(0.)
+        ax.xaxis.line.set_color(linec)
+
+        acolors = list(sorted(colors.cnames.keys()))[::-1]
+        acolors.pop(3)
+        self.skeleton = Line3DCollection(self.segments(0), colors=acolors[0], linewidths=2, zorder=3,
+                                         path_effects=[pe.Stroke(linewidth=3, foreground='black'), pe.Normal()])
+        ax.add_collection3d(self.skeleton)
+
+        self.scatter = None
+        if with_points:
+            self.buffer = np.zeros((3, max_points))
+            self.scatter = ax.scatter(*self.buffer, s=1.7, c='red', alpha=0.8, zorder=3)
+
+    def segments(self, i):
+        # (bones, 2, 3) line ends, y-up data to the z-up plot
+        pos = self.positions[i][self.bones]
+        return np.stack((pos[..., 0], -pos[..., 2], pos[..., 1]), axis=-1)
+
+    def update(self, i, xyz=None):
+        self.skeleton.set_segments(self.segments(i))
+        if self.scatter is not None and xyz is not None:
+            n = len(xyz)
+            if n > self.buffer.shape[1]:
+                self.buffer = np.zeros((3, n))
+            self.buffer[:, n:] = 0
+            self.buffer[0, :n] = xyz[:, 0] * SCALE
+            self.buffer[1, :n] = -xyz[:, 2] * SCALE
+            self.buffer[2, :n] = xyz[:, 1] * SCALE
+            self.scatter._offsets3d = tuple(self.buffer)
+        # Set the title for the current timestep
+        self.ax.set_title('Frame {}'.format(self.first_frame + i + 1), y=-0.01)
+        return [self.skeleton]
+
+    def animated_artists(self):
+        return [artist for artist in (self.skeleton, self.scatter, self.ax.title) if artist is not None]
+
+    def draw_animated(self):
+        # the camera does not move, so the projection of the full draw is still valid
+        for artist in self.animated_artists():
+            if hasattr(artist, 'do_3d_projection'):
+                artist.do_3d_projection()
+            self.ax.draw_artist(artist)
+
+
+def find_ffmpeg():
+    return shutil.which(matplotlib.rcParams['animation.ffmpeg_path'])
+
+
+def render_frames(positions, parents, h5_path, start, out, dpi=100, fps=20):
+    """
+    Render the frames start, start + 1, ... of positions (the display positions of those frames only)
+    with the Agg canvas, no display needed. out is a directory for frame_XXXXXX.png files, or a .mp4
+    file into which the raw frames are piped through ffmpeg.
+    The axes, panes and labels are drawn once, every frame only redraws the skeleton, points and title over them.
+    """
+    fig = Figure(figsize=(12, 8), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    scene = SkeletonScene(fig, positions, parents, with_points=h5_path is not None, first_frame=start)
+    fig.tight_layout()
+    for artist in scene.animated_artists():
+        artist.set_animated(True)
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    width, height = canvas.get_width_height()
+
+    encoder = None
+    if out.endswith('.mp4'):
+        encoder = subprocess.Popen([find_ffmpeg(), '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                                    '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                                    '-pix_fmt', 'yuv420p', out], stdin=subprocess.PIPE)
+    points = open_point_cloud(h5_path, prefetch=0) if h5_path is not None else None
+    try:
+        for k in range(len(positions)):
+            i = start + k
+            canvas.restore_region(background)
+            scene.update(k, None if points is None else points[i][..., :3])
+            scene.draw_animated()
+            if encoder is not None:
+                encoder.stdin.write(canvas.buffer_rgba())
+            else:
+                # low compression, the frames are often only read back by an encoder
+                image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+                image.convert('RGB').save(os.path.join(out, f'frame_{i:06}.png'), compress_level=1)
+    finally:
+        if points is not None:
+            points.close()
+        if encoder is not None:
+            encoder.stdin.close()
+            encoder.wait()
+    if encoder is not None and encoder.returncode != 0:
+        raise RuntimeError(f'ffmpeg failed writing {out}')
+    return len(positions)
+
+
+def export_animation(motion, h5_path, out, fps=20, workers=1, dpi=100, alignment=None):
+    """
+    Render a motion (and its LiDAR take, h5_path or None) headless to out: a .mp4 or .gif file,
+    or a directory for a PNG sequence. Frames are split into contiguous ranges rendered by
+    `workers` processes, each with its own figure and point cloud reader.
+    Videos need ffmpeg: every range is encoded as its own segment and the segments are joined.
+    Without ffmpeg, GIFs are assembled by Pillow from PNG frames, which keeps them all in memory.
+    alignment maps the LiDAR frames to the motion (default: 20 Hz frames spanning the motion).
+    """
+    positions = display_positions(motion, alignment)
+    num_frames = len(positions)
+    if h5_path is not None:
+        with open_point_cloud(h5_path, prefetch=0) as points:
+            num_frames = min(num_frames, len(points))
+
+    ext = os.path.splitext(out)[1].lower()
+    ffmpeg = find_ffmpeg()
+    if ext == '.mp4' and ffmpeg is None:
+        raise RuntimeError('ffmpeg is needed to write %s, export a PNG sequence instead (a directory as output)' % out)
+    work_dir = tempfile.mkdtemp() if ext in ('.mp4', '.gif') else out
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        bounds = np.linspace(0, num_frames, max(workers, 1) + 1).astype(int)
+        ranges = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        if ext in ('.mp4', '.gif') and ffmpeg is not None:
+            targets = [os.path.join(work_dir, f'segment_{k:03}.mp4') for k in range(len(ranges))]
+        else:
+            targets = [work_dir] * len(ranges)
+        jobs = [(positions[start:stop], motion.parents, h5_path, start, target, dpi, fps)
+                for (start, stop), target in zip(ranges, targets)]
+        if workers <= 1:
+            for job in jobs:
+                render_frames(*job)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(render_frames, *zip(*jobs)))
+
+        if ext in ('.mp4', '.gif') and ffmpeg is not None:
+            segments = os.path.join(work_dir, 'segments.txt')
+            with open(segments, 'w') as f:
+                f.writelines(f"file '{target}'\n" for target in targets)
+            codec = ['-c', 'copy'] if ext == '.mp4' else []
+            subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', segments] + codec + [out], check=True)
+        elif ext == '.gif':
+            paths = sorted(os.path.join(work_dir, f) for f in os.listdir(work_dir))
+            frames = (Image.open(path) for path in paths[1:])
+            Image.open(paths[0]).save(out, save_all=True, append_images=frames, duration=1000 / fps, loop=0)
+    finally:
+        if ext in ('.mp4', '.gif'):
+            shutil.rmtree(work_dir)
+    return num_frames
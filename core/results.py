@@ -0,0 +1,142 @@
+import os
+import json
+import sqlite3
+import hashlib
+import numpy as np
+
+# bump when the metrics change, so stored rows are recomputed
+STORE_VERSION = 1
+# bump when the tables change, older tables are dropped
+SCHEMA_VERSION = 2
+
+
+def file_hash(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class MetricStore:
+    """
+    SQLite table of inference_err results, one row per (evaluation, file, dtype, variant), the file
+    being the GT path relative to the data root (takes of different directories may share a name),
+    so float32 and float64 runs keep their own rows.
+    A file is scored together with all its variants (match_length cuts them to a common length),
+    so the rows of a file share one key: the content hashes of its GT and model output BVH files,
+    the GT and variant parameters and STORE_VERSION. A row whose key differs is stale.
+    Content hashes are remembered by path, mtime and size, so unchanged files are not read again.
+    The extra metrics of the config (core.metrics) are kept in their own table under the same key,
+    one row per (evaluation, file, dtype, variant, metric), so adding a metric only computes the files once more.
+    """
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript(f'''
+                DROP TABLE IF EXISTS metrics;
+                DROP TABLE IF EXISTS extra;
+                PRAGMA user_version = {SCHEMA_VERSION};''')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS metrics (
+                evaluation TEXT, path TEXT, dtype TEXT, variant TEXT, file_name TEXT, key TEXT, joint_names TEXT,
+                averages TEXT, pos BLOB, rot BLOB, linvel BLOB, angvel BLOB, length INTEGER,
+                PRIMARY KEY (evaluation, path, dtype, variant));
+            CREATE TABLE IF NOT EXISTS extra (
+                evaluation TEXT, path TEXT, dtype TEXT, variant TEXT, metric TEXT, key TEXT, per_joint BLOB,
+                PRIMARY KEY (evaluation, path, dtype, variant, metric));
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT);
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self.db.execute('SELECT hash FROM hashes WHERE path = ? AND mtime_ns = ? AND size = ?',
+                              (path, st.st_mtime_ns, st.st_size)).fetchone()
+        if row is not None:
+            return row[0]
+        digest = file_hash(path)
+        self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)', (path, st.st_mtime_ns, st.st_size, digest))
+        return digest
+
+    def group_key(self, config, gt_path, source_paths):
+        """
+        Key of the rows of one GT file, arguments as evaluate_group.
+        """
+        desc = {
+            'version': STORE_VERSION,
+            'gt': self.file_hash(gt_path),
+            'sources': {tag: self.file_hash(path) for tag, path in source_paths.items()},
+            'blender': config['blender'],
+            'gt_params': config['gt'],
+            # titles only decorate the report
+            'variants': [{k: v for k, v in variant.items() if k != 'title'} for variant in config['variants']],
+        }
+        # rows computed before the dtype option are float64
+        if config.get('dtype', 'float64') != 'float64':
+            desc['dtype'] = config['dtype']
+        if config.get('metric_params'):
+            desc['metric_params'] = config['metric_params']
+        return hashlib.sha1(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+    def row_id(self, config, gt_path):
+        """
+        (evaluation, path, dtype) identifying the rows of a GT file, path relative to the data root
+        without extension.
+        """
+        path = os.path.splitext(os.path.relpath(gt_path, config['data_path']))[0].replace(os.sep, '/')
+        return config['name'], path, config.get('dtype', 'float64')
+
+    def get_group(self, config, gt_path, key):
+        """
+        Stored result of evaluate_group for gt_path, or None when a variant or extra metric is missing or stale.
+        """
+        row_id = self.row_id(config, gt_path)
+        metrics, extra, file_name, joint_names = {}, {}, None, None
+        for variant in config['variants']:
+            row = self.db.execute('SELECT key, file_name, joint_names, averages, pos, rot, linvel, angvel, length FROM metrics '
+                                  'WHERE evaluation = ? AND path = ? AND dtype = ? AND variant = ?',
+                                  row_id + (variant['name'],)).fetchone()
+            if row is None or row[0] != key:
+                return None
+            file_name, joint_names = row[1], np.array(json.loads(row[2]))
+            per_joint = tuple(np.frombuffer(blob, dtype=np.float64) for blob in row[4:8])
+            metrics[variant['name']] = tuple(json.loads(row[3])) + per_joint + (row[8],)
+            extra[variant['name']] = {}
+            for metric in config.get('metrics', []):
+                row = self.db.execute('SELECT key, per_joint FROM extra '
+                                      'WHERE evaluation = ? AND path = ? AND dtype = ? AND variant = ? AND metric = ?',
+                                      row_id + (variant['name'], metric)).fetchone()
+                if row is None or row[0] != key:
+                    return None
+                extra[variant['name']][metric] = np.frombuffer(row[1], dtype=np.float64)
+        return file_name, joint_names, metrics, extra
+
+    def put_group(self, config, gt_path, key, result):
+        file_name, joint_names, metrics, extra = result
+        row_id = self.row_id(config, gt_path)
+        rows = []
+        for name, values in metrics.items():
+            averages = json.dumps([float(x) for x in values[:8]])
+            per_joint = [np.asarray(x, dtype=np.float64).tobytes() for x in values[8:12]]
+            rows.append(row_id + (name, file_name, key, json.dumps([str(x) for x in joint_names]), averages,
+                                  *per_joint, int(values[-1])))
+        self.db.executemany('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.db.executemany('INSERT OR REPLACE INTO extra VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            [row_id + (name, metric, key, np.asarray(per_joint, dtype=np.float64).tobytes())
+                             for name, values in extra.items() for metric, per_joint in values.items()])
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
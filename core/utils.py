@@ -1,11 +1,12 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.animation as matanim
-import matplotlib.colors as colors
-import matplotlib.patheffects as pe
 from scipy.spatial.transform import Rotation as R
+from core.animation import quat_mul, quat_conj, quat_basis
+from core.render import display_positions, SkeletonScene
 
 
 def get_bvh_filepaths(datapath):
@@ -16,6 +17,16 @@ def get_bvh_filepaths(datapath):
                 filepaths.append(os.path.join(root, file))
     return filepaths
 
+def parallel_map(fn, jobs, workers=1):
+    """
+    Call fn(*job) for every job, over a process pool when workers > 1.
+    Results are returned in the order of jobs, so the output equals a serial run.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [fn(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fn, *zip(*jobs)))
+
 def save_to_csv(data, path, columns, index):
     df = pd.DataFrame(data, columns=columns, index=index)
     df.to_csv(path)
@@ -23,8 +34,7 @@ def save_to_csv(data, path, columns, index):
 def match_length(list):
     min_length = min([x.length for x in list])
     for x in list:
-        x.local_t = x.local_t[:min_length]
-        x.length = min_length
+        x.select_frames(slice(0, min_length))
 
 def get_angle(v1, v2):
     v1 = v1 / np.linalg.norm(v1, axis=-1, keepdims=True)
@@ -36,64 +46,69 @@ def get_angle_mat(m1, m2):
     r = R.from_matrix(r).as_rotvec()
     return np.linalg.norm(r, axis=-1) * 180 / np.pi
 
-def inference_err(output, target):
-    length = output.local_t.shape[0]
-    
-    # position - global
-    pelv_pos = output.local_t[..., 0, :3, 3].reshape(length, 1, 3)
-    gt_pelv_pos = target.local_t[..., 0, :3, 3].reshape(length, 1, 3)
-    joint_pos = output.world_t[..., 1:, :3, 3]
-    gt_joint_pos = target.world_t[..., 1:, :3, 3]
-    pos = np.concatenate((pelv_pos, joint_pos), axis=1)    
-    gt_pos = np.concatenate((gt_pelv_pos, gt_joint_pos), axis=1)
-    pos_err = np.linalg.norm(pos - gt_pos, axis=-1)
-    per_joint_pos_err = np.mean(pos_err, axis=0)
-    
+def get_positions(anim, frames=slice(None), dtype=np.float64):
+    """
+    Pelvis position from the local root transform and root-relative world positions of the other joints, (T, J, 3).
+    Without world transforms (compute_world_transform), only the positions are composed (Animation.world_positions).
+    """
+    if anim.is_compact:
+        pelv_pos = anim.local_p[frames, :1].astype(dtype)
+        joint_pos = None if anim.world_p is None else anim.world_p[frames, 1:]
+    else:
+        pelv_pos = anim.local_t[frames, :1, :3, 3].astype(dtype, copy=False)
+        joint_pos = None if anim.world_t is None else anim.world_t[frames, 1:, :3, 3]
+    if joint_pos is None:
+        joint_pos = anim.world_positions(np.arange(1, len(anim.parents)), frames)
+    return np.concatenate((pelv_pos, joint_pos.astype(dtype, copy=False)), axis=1)
+
+def get_rotation_basis(anim, frames=slice(None), dtype=np.float64):
+    """
+    x and y basis vectors of the local rotations (T, J, 3) and of the frame-to-frame rotations (T - 1, J, 3).
+    """
+    if anim.is_compact:
+        q = anim.local_q[frames].astype(dtype)
+        x_basis, y_basis = quat_basis(q)
+        angvel_x_basis, angvel_y_basis = quat_basis(quat_mul(q[1:], quat_conj(q[:-1])))
+    else:
+        rot = anim.local_t[frames, :, :3, :3].astype(dtype, copy=False)
+        # rotations are orthonormal, the transpose is the inverse
+        angvel = rot[1:] @ np.swapaxes(rot[:-1], -1, -2)
+        x_basis, y_basis = rot[..., :3, 0], rot[..., :3, 1]
+        angvel_x_basis, angvel_y_basis = angvel[..., :3, 0], angvel[..., :3, 1]
+    return x_basis, y_basis, angvel_x_basis, angvel_y_basis
+
+def inference_err(output, target, chunk_size=None, dtype=None):
+    """
+    Position, rotation, linear and angular velocity errors of output against target.
+    With chunk_size the frames are processed in chunks of that many frames (plus one frame
+    of overlap for the velocities), so peak memory no longer grows with the sequence length.
+    The per-joint sums are the same, results only differ by float summation order (~1e-15).
+    The errors are computed in dtype, by default the dtype of the animations (float32 only when
+    both are float32); the per-joint sums are accumulated in float64.
+    core.metrics.MetricEngine computes them, together with any other registered metric.
+    """
+    # imported here, core.metrics imports this module
+    from core.metrics import MetricEngine, BASE_METRICS
+    sums, _ = MetricEngine(BASE_METRICS, chunk_size, dtype).sums(output, target)
+    return summarize_err(*(sums[name] for name in BASE_METRICS), output.length)
+
+def summarize_err(pos_err_sum, rot_err_sum, linvel_err_sum, angvel_err_sum, length):
+    """
+    The inference_err tuple from the per-joint error sums over length frames.
+    """
+    per_joint_pos_err = pos_err_sum / length
     avg_pelvis_pos_err = per_joint_pos_err[0]
     avg_joint_pos_err = np.mean(per_joint_pos_err[1:])
-    
-    # linear velocity - global
-    pelv_linvel = pelv_pos[1:] - pelv_pos[:-1]
-    gt_pelv_linvel = gt_pelv_pos[1:] - gt_pelv_pos[:-1]
-    joint_linvel = joint_pos[1:] - joint_pos[:-1]
-    gt_joint_linvel = gt_joint_pos[1:] - gt_joint_pos[:-1]
-    linvel = np.concatenate((pelv_linvel, joint_linvel), axis=1)
-    gt_linvel = np.concatenate((gt_pelv_linvel, gt_joint_linvel), axis=1)
-    linvel_err = np.linalg.norm(linvel - gt_linvel, axis=-1)
-    per_joint_linvel_err = np.mean(linvel_err, axis=0)
+
+    per_joint_linvel_err = linvel_err_sum / (length - 1)
     avg_pelv_linvel_err = per_joint_linvel_err[0]
     avg_joint_linvel_err = np.mean(per_joint_linvel_err[1:])
-    
-    # rotation - local
-    rot = output.local_t[..., :3, :3]
-    gt_rot = target.local_t[..., :3, :3]
-        
-    gt_x_basis = gt_rot[..., :3, 0]
-    gt_y_basis = gt_rot[..., :3, 1]
-    x_basis = rot[..., :3, 0]
-    y_basis = rot[..., :3, 1]
-    
-    x_err = get_angle(gt_x_basis, x_basis)
-    y_err = get_angle(gt_y_basis, y_basis)
-    rot_err = (x_err + y_err) / 2
 
-    per_joint_rot_err = np.mean(rot_err, axis=0)
+    per_joint_rot_err = rot_err_sum / length
     avg_pelvis_rot_err = per_joint_rot_err[0]
     avg_joint_rot_err = np.mean(per_joint_rot_err[1:])
-    
-    # angular velocity - local
-    angvel = rot[1:] @ np.linalg.inv(rot[:-1])
-    gt_angvel = gt_rot[1:] @ np.linalg.inv(gt_rot[:-1])
-    
-    gt_angvel_x_basis = gt_angvel[..., :3, 0]
-    gt_angvel_y_basis = gt_angvel[..., :3, 1]
-    angvel_x_basis = angvel[..., :3, 0]
-    angvel_y_basis = angvel[..., :3, 1]
-    angvel_x_err = get_angle(gt_angvel_x_basis, angvel_x_basis)
-    angvel_y_err = get_angle(gt_angvel_y_basis, angvel_y_basis)
-    angvel_err = (angvel_x_err + angvel_y_err) / 2
-    
-    per_joint_angvel_err = np.mean(angvel_err, axis=0)
+
+    per_joint_angvel_err = angvel_err_sum / (length - 1)
     avg_pelv_angvel_err = per_joint_angvel_err[0]
     avg_joint_angvel_err = np.mean(per_joint_angvel_err[1:])
     
@@ -101,6 +116,18 @@ def inference_err(output, target):
            avg_joint_pos_err, avg_joint_rot_err, avg_joint_linvel_err, avg_joint_angvel_err, \
            per_joint_pos_err, per_joint_rot_err, per_joint_linvel_err, per_joint_angvel_err, length
 
+ERR_NAMES = ('pelvis_pos', 'pelvis_rot', 'pelvis_linvel', 'pelvis_angvel',
+             'joint_pos', 'joint_rot', 'joint_linvel', 'joint_angvel',
+             'per_joint_pos', 'per_joint_rot', 'per_joint_linvel', 'per_joint_angvel', 'length')
+
+def err_deviation(result, reference):
+    """
+    Maximum absolute deviation of every inference_err output from a reference result
+    (e.g. the float64 one of the same file), {name in ERR_NAMES: deviation}.
+    """
+    return {name: float(np.max(np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64))))
+            for name, a, b in zip(ERR_NAMES, result, reference)}
+
 def calculate_average_error(lengths, pos_errs, rot_errs, linvel_errs, angvel_errs, joint_names, file_names, result_path, prefix):
     """
     Calculate the average error and save it as a CSV.
@@ -136,100 +163,37 @@ def calculate_average_error(lengths, pos_errs, rot_errs, linvel_errs, angvel_err
 
     return avg_pos_errs, avg_rot_errs, avg_linvel_errs, avg_angvel_errs
 
-def animation_plot(motion, points, fps=20):
-    motion.compute_world_transform(fix_root=False)
-    parents = motion.parents
+def calculate_metric_average(lengths, errs, joint_names, file_names, result_path, prefix, metric):
+    """
+    calculate_average_error for a single metric of the core.metrics registry:
+    errs are the per-joint errors of every file times its length.
+    Saves <prefix>_sum_per_joint_<metric>_err.csv and returns the per-joint average.
+    """
+    lengths_arr = np.asarray(lengths)
+    errs_arr = np.asarray(errs)
+    avg_errs = np.divide(np.sum(errs_arr, axis=0), np.sum(lengths_arr))
+    errs_arr = np.insert(errs_arr, 0, lengths_arr, axis=1)
+    pd.DataFrame(errs_arr, index=file_names, columns=joint_names).to_csv(result_path + f'{prefix}_sum_per_joint_{metric}_err.csv')
+    return avg_errs
 
-    Grot = motion.world_t[..., :3, :3]
-    Gpos = motion.world_t[..., :3, 3]
+def animation_plot(motion, points, fps=20, alignment=None):
+    """
+    Play the skeleton together with the point clouds. points is indexed by frame,
+    e.g. a core.pointcloud.PointCloudFrames that reads frames from the .h5 on demand.
+    core.render.export_animation renders the same scene to a video without a display.
+    alignment (core.alignment.Alignment) maps the LiDAR frames to the motion, by default 20 Hz frames spanning it.
+    """
+    # skeleton at the LiDAR frames, to synchronize with pcd data (20hz)
+    animation = display_positions(motion, alignment)
 
-    """ 60fps -> 20fps to synchronize with pcd data (20hz) for visualziation """
-    Grot, Gpos = Grot[::3], Gpos[::3]
-    scale = 30
-    animation = Gpos * scale
-            
     fig = plt.figure(figsize=(12, 8))
-    ax = fig.add_subplot(111, projection='3d')
-    rscale = scale * 1.5
-    ax.set_xlim3d(-rscale, rscale)
-    ax.set_zlim3d(0, rscale*2)
-    ax.set_ylim3d(-rscale, rscale)
-
-    # ax.set_xticks([])
-    # ax.set_yticks([])
-    # ax.set_zticks([])
-    ax.set_xlabel('X')
-    ax.set_ylabel('Y')
-    ax.set_zlabel('Z')
-    ax.view_init(20, -60) # (-40, 60): up view
-    # ax.view_init(0, -90)
-    ax.set_proj_type('ortho')
-
-    # checkerboard pane
-    facec = (254, 254, 254)
-    linec = (240, 240, 240)
-    facec = list(np.array(facec) / 256.0) + [1.0]
-    linec = list(np.array(linec) / 256.0) + [1.0]
-
-    ax.zaxis.set_pane_color(facec)
-    ax.yaxis.set_pane_color((1.0, 1.0, 1.0, 0.0))
-    ax.xaxis.set_pane_color((1.0, 1.0, 1.0, 0.0))
-
-    X = np.arange(-rscale, rscale, 10)
-    Y = np.arange(-rscale, rscale, 10)
-    xlen = len(X)
-    ylen = len(Y)
-    X, Y = np.meshgrid(X, Y)
-    Z = np.zeros(X.shape) # place it at a lower surface
-
-    colortuple = (facec, linec)
-    colors_pane = np.zeros((Z.shape + (4, )))
-    for y in range(ylen):
-        for x in range(xlen):
-            colors_pane[y, x] = colortuple[(x + y) % len(colortuple)]
-
-    ax.zaxis.line.set_lw(0.)
-    ax.yaxis.line.set_lw(0.)
-    ax.yaxis.line.set_color(linec)
-    ax.xaxis.line.set_lw(0.)
-    ax.xaxis.line.set_color(linec)
-
-    acolors = list(sorted(colors.cnames.keys()))[::-1]
-    acolors.pop(3)
-    skel_lines = [plt.plot([0,0], [0,0], [0,0], color=acolors[0], zorder=3,
-        lw=2, path_effects=[pe.Stroke(linewidth=3, foreground='black'), pe.Normal()]
-        )[0] for _ in range(animation.shape[1])]
-    
-    # Initialize the scatter plot
-    if points is not None:
-        dummy = np.zeros((1000, 3))
-        scatter = ax.scatter(dummy[:,0], dummy[:,1], dummy[:,2], s=1.7, c='red', alpha=0.8, zorder=3)
-    
-    def animate(i):        
-        changed = []
-        for j in range(len(parents)):
-            if parents[j] != -1:
-                skel_lines[j].set_data(
-                    [ animation[i,j,0],  animation[i,parents[j],0]],
-                    [-animation[i,j,2], -animation[i,parents[j],2]])
-                skel_lines[j].set_3d_properties(
-                    [ animation[i,j,1],  animation[i,parents[j],1]])
-        changed += skel_lines
-        
-        if points is not None:
-            xyz = points[i][..., :3]
-            # xyz = pad_or_sample_point_cloud(xyz, max_points=384, rgb=False)
-            if len(xyz) < 1000:
-                xyz = np.concatenate((xyz, np.zeros((1000-len(xyz), 3))))
-            scatter._offsets3d = (xyz[:, 0]*scale, -xyz[:, 2]*scale, xyz[:, 1]*scale)
-
-        # Set the title for the current timestep
-        ax.set_title('Frame {}'.format(i+1), y=-0.01)
-
-        return changed
-        
+    scene = SkeletonScene(fig, animation, motion.parents, with_points=points is not None)
+
+    def animate(i):
+        return scene.update(i, None if points is None else points[i][..., :3])
+
     plt.tight_layout()
-        
+
     ani = matanim.FuncAnimation(fig, animate, np.arange(len(animation)), interval=1000/fps)
-        
+
     plt.show()
@@ -0,0 +1,221 @@
+import os
+import json
+import argparse
+import numpy as np
+import core.animation as anim
+from core.alignment import Alignment, LIDAR_FPS
+from core.catalog import Catalog, build_catalog, DEFAULT_CATALOG, DEFAULT_ROOTS
+from core.pointcloud import open_point_cloud
+from core.preprocess import process_take
+from core.utils import parallel_map
+
+# bump when the layout of the shards changes
+WINDOWS_VERSION = 1
+SHARD_KEYS = ('points', 'counts', 'local_q', 'local_p')
+
+
+def window_starts(alignment, window, stride, upsample=1):
+    """
+    First LiDAR frames of the windows of a take, and the timestamps (K * upsample,) of the poses
+    of LiDAR frames 0 .. K - 1, K being the end of the last window. A window only covers LiDAR
+    frames whose poses all fall inside the motion.
+    """
+    sub = np.arange(upsample) / (alignment.lidar_fps * upsample)
+    times = (alignment.lidar_times[:, None] + sub[None]).reshape(-1)
+    pos = alignment.motion_pos_at(times)
+    covered = ((pos >= -1e-6) & (pos <= alignment.motion_length - 1 + 1e-6)).reshape(-1, upsample).all(axis=1)
+    frames = np.flatnonzero(covered)
+    if len(frames) < window:
+        return np.zeros(0, dtype=np.int64), times[:0]
+    # LiDAR frames inside the motion are contiguous
+    starts = np.arange(frames[0], frames[-1] - window + 2, stride, dtype=np.int64)
+    end = starts[-1] + window
+    return starts, times[:end * upsample]
+
+
+def take_alignment(record, lidar_fps=LIDAR_FPS, lidar_offset=0.0):
+    return Alignment(record['bvh_frames'], record['lidar_frames'], record['fps'], lidar_fps, 0.0, lidar_offset)
+
+
+def shard_path(out_dir, shard, key):
+    return os.path.join(out_dir, f'shard_{shard:05}_{key}.npy')
+
+
+def write_take(record, take_index, first_window, num_windows, out_dir, params):
+    """
+    Cut the windows of one take and write them to rows first_window, ... of the shards,
+    which are already allocated. Runs in a worker process.
+    """
+    window, upsample, shard_size = params['window'], params['upsample'], params['shard_size']
+    motion = anim.Animation()
+    motion.load_bvh(record['bvh'])
+    if len(motion.parents) != len(params['parents']):
+        raise ValueError(f"{record['bvh']} has {len(motion.parents)} joints, the dataset {len(params['parents'])}")
+    alignment = Alignment.of(motion, record['lidar_frames'], params['lidar_fps'], lidar_offset=params['lidar_offset'])
+    starts, times = window_starts(alignment, window, params['stride'], upsample)
+    if len(starts) != num_windows:
+        raise ValueError(f"{record['bvh']} changed since the catalog was built, rebuild it")
+    num_frames = len(times) // upsample
+
+    # every pose of the take once, in one batched slerp/lerp
+    local_q, local_p = anim.decompose_transforms(alignment.sample(motion, times), np.float32)
+    center = local_p[::upsample, 0] if params['center'] else None
+    rng = np.random.default_rng([params['seed'], take_index])
+    with open_point_cloud(record['h5'], prefetch=0) as source:
+        points, counts = process_take(source, num_frames, params['num_points'], params['sampling'],
+                                      params['voxel_size'], center, rng)
+
+    frames = starts[:, None] + np.arange(window)[None]
+    poses = starts[:, None] * upsample + np.arange(window * upsample)[None]
+    values = {'points': points[frames], 'counts': counts[frames].astype(np.int32),
+              'local_q': local_q[poses], 'local_p': local_p[poses]}
+    # the windows of a take can straddle shards
+    g = first_window
+    while g < first_window + len(starts):
+        shard, row = divmod(g, shard_size)
+        n = min(shard_size - row, first_window + len(starts) - g)
+        for key in SHARD_KEYS:
+            out = np.load(shard_path(out_dir, shard, key), mmap_mode='r+')
+            out[row:row + n] = values[key][g - first_window:g - first_window + n]
+            out.flush()
+            del out
+        g += n
+    return len(starts)
+
+
+def build_windows(records, out_dir, window=30, stride=10, num_points=256, sampling='fps', voxel_size=None,
+                  upsample=1, center=False, shard_size=1024, lidar_fps=LIDAR_FPS, lidar_offset=0.0, seed=0, workers=1):
+    """
+    Cut every take of records (catalog records with a BVH and an .h5) into windows of `window` LiDAR
+    frames, one every `stride` frames, and write them to shards of shard_size windows in out_dir:
+        points  (n, window, num_points, 3) float32, preprocessed as core.preprocess
+        counts  (n, window) int32, points per frame before sampling (0 for missing frames)
+        local_q (n, window * upsample, J, 4) float32, local rotations at the LiDAR frames
+                (upsample poses per LiDAR frame, e.g. 3 for the 60 Hz poses)
+        local_p (n, window * upsample, J, 3) float32, local translations
+    The last shard holds the remaining windows. The window layout is planned from the catalog
+    frame counts, so takes are written by `workers` processes straight into their rows.
+    index.json describes the shards and takes, windows.npy holds (take, first LiDAR frame) per window.
+    """
+    records = [r for r in records if r['bvh'] and r['h5']]
+    plan, first_window = [], 0
+    for take_index, record in enumerate(records):
+        starts, _ = window_starts(take_alignment(record, lidar_fps, lidar_offset), window, stride, upsample)
+        plan.append((take_index, first_window, starts))
+        first_window += len(starts)
+    num_windows = first_window
+    if num_windows == 0:
+        raise ValueError('No take is long enough for a window of %d frames' % window)
+
+    skeleton = anim.Animation()
+    with open(records[0]['bvh'], 'r') as bvh:
+        skeleton.read_header(bvh)
+    num_joints = len(skeleton.parents)
+    os.makedirs(out_dir, exist_ok=True)
+    shapes = {'points': ((window, num_points, 3), np.float32), 'counts': ((window,), np.int32),
+              'local_q': ((window * upsample, num_joints, 4), np.float32),
+              'local_p': ((window * upsample, num_joints, 3), np.float32)}
+    shards = []
+    for shard, start in enumerate(range(0, num_windows, shard_size)):
+        n = min(shard_size, num_windows - start)
+        for key, (shape, dtype) in shapes.items():
+            np.lib.format.open_memmap(shard_path(out_dir, shard, key), mode='w+', dtype=dtype, shape=(n,) + shape).flush()
+        shards.append({'windows': n, **{key: os.path.basename(shard_path(out_dir, shard, key)) for key in SHARD_KEYS}})
+
+    params = {'window': window, 'stride': stride, 'num_points': num_points, 'sampling': sampling, 'voxel_size': voxel_size,
+              'upsample': upsample, 'center': center, 'shard_size': shard_size, 'lidar_fps': lidar_fps,
+              'lidar_offset': lidar_offset, 'seed': seed, 'parents': [int(p) for p in skeleton.parents]}
+    jobs = [(records[take_index], take_index, first, len(starts), out_dir, params)
+            for take_index, first, starts in plan if len(starts)]
+    parallel_map(write_take, jobs, workers)
+
+    np.save(os.path.join(out_dir, 'windows.npy'),
+            np.concatenate([np.stack((np.full(len(starts), take_index), starts), axis=1) for take_index, _, starts in plan]))
+    takes = [{key: record[key] for key in ('dataset', 'split', 'subject', 'take', 'bvh', 'h5')}
+             for record in records]
+    for (_, first, starts), take in zip(plan, takes):
+        take.update({'first_window': first, 'num_windows': len(starts)})
+    index = dict(params, version=WINDOWS_VERSION, joints=[str(j) for j in skeleton.joints],
+                 num_windows=num_windows, shards=shards, takes=takes)
+    # written last, a directory without index.json is an interrupted build
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=1)
+    return num_windows
+
+
+class WindowDataset:
+    """
+    Windows written by build_windows. Shards are memory-mapped, so dataset[i] returns views
+    into them without reading or parsing anything else:
+
+        dataset = WindowDataset('./datasets/windows')
+        sample = dataset[i]   # {'points', 'counts', 'local_q', 'local_p'}
+    """
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'index.json'), 'r') as f:
+            self.index = json.load(f)
+        if self.index['version'] != WINDOWS_VERSION:
+            raise ValueError(f"{root} was built with version {self.index['version']}, rebuild it")
+        self.windows = np.load(os.path.join(root, 'windows.npy'))
+        self.shard_size = self.index['shard_size']
+        self.parents = np.array(self.index['parents'])
+        self.shards = [{key: np.load(os.path.join(root, shard[key]), mmap_mode='r') for key in SHARD_KEYS}
+                       for shard in self.index['shards']]
+
+    def __len__(self):
+        return self.index['num_windows']
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard, row = divmod(idx, self.shard_size)
+        return {key: array[row] for key, array in self.shards[shard].items()}
+
+    def take(self, idx):
+        """
+        Take record and first LiDAR frame of window idx.
+        """
+        take_index, start = self.windows[idx]
+        return self.index['takes'][take_index], int(start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cut the takes of a split into fixed-length (LiDAR, pose) windows in memory-mapped shards.')
+    parser.add_argument('--out', type=str, required=True, help='Output directory')
+    parser.add_argument('--catalog', type=str, default=DEFAULT_CATALOG, help='Catalog file, built from --roots when missing')
+    parser.add_argument('--roots', type=str, nargs='*', default=DEFAULT_ROOTS)
+    parser.add_argument('--split', type=str, nargs='*', default=['train'])
+    parser.add_argument('--dataset', type=str, nargs='*')
+    parser.add_argument('--window', type=int, default=30, help='LiDAR frames per window')
+    parser.add_argument('--stride', type=int, default=10, help='LiDAR frames between window starts')
+    parser.add_argument('--upsample', type=int, default=1, help='Poses per LiDAR frame (3: the 60 Hz poses)')
+    parser.add_argument('--num-points', type=int, default=256)
+    parser.add_argument('--sampling', type=str, default='fps', choices=['fps', 'random'])
+    parser.add_argument('--voxel-size', type=float, default=None)
+    parser.add_argument('--center', action='store_true', help='Points relative to the root at the same instant')
+    parser.add_argument('--lidar-offset', type=float, default=0.0, help='Start of the LiDAR recordings relative to the mocap, in seconds')
+    parser.add_argument('--shard-size', type=int, default=1024, help='Windows per shard')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes writing takes')
+    args = parser.parse_args()
+
+    if os.path.exists(args.catalog):
+        catalog = Catalog.load(args.catalog)
+    else:
+        catalog = build_catalog(args.roots)
+        catalog.save(args.catalog)
+    criteria = {'split': args.split}
+    if args.dataset:
+        criteria['dataset'] = args.dataset
+    records = catalog.select(**criteria).records
+    num_windows = build_windows(records, args.out, args.window, args.stride, args.num_points, args.sampling, args.voxel_size,
+                                args.upsample, args.center, args.shard_size, lidar_offset=args.lidar_offset,
+                                seed=args.seed, workers=args.workers)
+    print(f'Saved {num_windows} windows of {len(records)} takes to {args.out}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+from collections import Counter
+
+from benchmarks.synthetic import write_bvh
+from core.evaluation import run_evaluation
+from core.profiling import profiler
+
+
+def make_config(tmp_path, num_files=3):
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    for i in range(num_files):
+        write_bvh(str(data_path / f'take{i}.bvh'), 120, seed=i)
+        write_bvh(str(data_path / f'take{i}_model.bvh'), 120, seed=100 + i)
+    return {
+        'name': 'profile_test',
+        'data_path': str(data_path),
+        'result_path': str(tmp_path / 'results'),
+        'blender': False,
+        'gt': {'ftrim': 10, 'btrim': 10},
+        'variants': [
+            {'name': 'base', 'tag': 'model', 'ftrim': 10, 'btrim': 10},
+            {'name': 'dup', 'tag': 'model', 'ftrim': 10, 'btrim': 10, 'dup': 2},
+        ],
+        'print_pelvis': True,
+        'rule': '--',
+        'chunk_size': None,
+        'dtype': 'float64',
+        'metrics': [],
+        'metric_params': {},
+        'store': str(tmp_path / 'results' / 'metrics.sqlite'),
+    }
+
+
+def stage_counts(config, workers, **kwargs):
+    profiler.records = []
+    run_evaluation(config, workers=workers, profile_path=os.path.join(config['result_path'], 'profile.json'), **kwargs)
+    return Counter(record['stage'] for record in profiler.records)
+
+
+def test_worker_records_are_counted_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'enabled', True)
+    monkeypatch.setattr(profiler, 'records', [])
+    config = make_config(tmp_path)
+
+    serial = stage_counts(dict(config, store=None), workers=1)
+    parallel = stage_counts(dict(config, store=None), workers=2)
+    assert parallel == serial
+    assert serial['csv_write'] == 2
+
+    # the store stage runs once in the parent before the pool is forked
+    parallel = stage_counts(config, workers=3, recompute=True)
+    assert parallel['store'] == 1
+    assert parallel['csv_write'] == 2
+    assert parallel - Counter(store=1) == serial
+
+
+def test_precision_check_records_are_counted_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'enabled', True)
+    monkeypatch.setattr(profiler, 'records', [])
+    config = dict(make_config(tmp_path), store=None)
+
+    serial = stage_counts(dict(config, dtype='float32'), workers=1, check_precision=True)
+    parallel = stage_counts(dict(config, dtype='float32'), workers=2, check_precision=True)
+    assert parallel == serial
+    assert parallel['csv_write'] == 2
+    assert parallel['precision_check'] == 1
@@ -1,14 +1,19 @@
-import numpy as np
-import h5py
 from core.utils import animation_plot
+from core.pointcloud import open_point_cloud
+from core.render import export_animation
+from core.alignment import Alignment
 import core.animation as anim
-import os
 import argparse
 
 # Add argument parsing
 parser = argparse.ArgumentParser(description='Visualize motion capture and point cloud data.')
 parser.add_argument('--bvh', type=str, required=True, help='Path to the BVH file')
 parser.add_argument('--h5', type=str, required=True, help='Path to the H5 file')
+parser.add_argument('--prefetch', type=int, default=30, help='Number of point cloud frames read ahead in the background')
+parser.add_argument('--export', type=str, default=None, help='Render to a .mp4/.gif file or a PNG directory instead of playing')
+parser.add_argument('--workers', type=int, default=1, help='Number of processes rendering frames (with --export)')
+parser.add_argument('--dpi', type=int, default=100, help='Resolution of the exported frames (with --export)')
+parser.add_argument('--lidar-offset', type=float, default=0.0, help='Start of the LiDAR recording relative to the mocap, in seconds')
 args = parser.parse_args()
 
 # Use the provided file paths
@@ -16,28 +21,15 @@ bvh_file = args.bvh
 h5_file_path = args.h5
 
 # Load motion bvh data
-# Load corresponding pcd data (hdf5)
+# Open corresponding pcd data (hdf5), frames are read on demand while playing
 mot = anim.Animation()
 mot.load_bvh(bvh_file)   
+alignment = Alignment.of(mot, lidar_offset=args.lidar_offset)
 
-pcd_np_dict = {}
-num_loaded_frames = 0
-with h5py.File(h5_file_path, 'r') as pcd_data:
-    total_frames = len(pcd_data.keys())
-    for frame_idx in range(len(pcd_data.keys())):
-        group_name = f"frame-{frame_idx:06}"
-        if group_name in pcd_data:
-            group = pcd_data[group_name]
-            try :
-                pcd = group['pointcloud'][()]
-                pcd_np_dict[frame_idx] = np.asarray(pcd, dtype=np.float32)
-                num_loaded_frames += 1
-            except:
-                pcd_np_dict[frame_idx] = np.array([])
-                print(f'No pcd data on frame number: {frame_idx:4}')
-        else:
-            raise ValueError('No pcd data on %s' % group_name)
-print(f'Loaded {num_loaded_frames} among {total_frames} frames from {h5_file_path}')
-
-
-animation_plot(mot, pcd_np_dict, fps=20)
+if args.export:
+    num_frames = export_animation(mot, h5_file_path, args.export, fps=20, workers=args.workers, dpi=args.dpi, alignment=alignment)
+    print(f'Exported {num_frames} frames to {args.export}')
+else:
+    with open_point_cloud(h5_file_path, prefetch=args.prefetch) as pcd_frames:
+        print(f'Opened {len(pcd_frames)} frames from {h5_file_path}')
+        animation_plot(mot, pcd_frames, fps=20, alignment=alignment)